@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import neres.newrelic as newrelic
+from neres.monitor import Monitor
+
+
+class AsyncClient(object):
+    """Awaitable version of the neres.newrelic API for a single account.
+
+    Requests go through the same session as the synchronous functions, so
+    they share the cookie jar, XSRF handling and caches, and results are
+    identical. Blocking calls run on a thread pool and at most `concurrency`
+    of them are in flight at any time.
+
+        async with AsyncClient(account) as client:
+            monitors = await client.get_monitors()
+    """
+    def __init__(self, account, concurrency=newrelic.DEFAULT_CONCURRENCY,
+                 page_size=newrelic.DEFAULT_PAGE_SIZE):
+        self.account = account
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        # Created on first use so that it belongs to the running loop.
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        # Waiting for the pool to finish blocks, keep it off the loop.
+        await asyncio.get_event_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def _call(self, function, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_event_loop()
+        async with self._semaphore:
+            return await loop.run_in_executor(
+                self._executor, functools.partial(function, *args, **kwargs))
+
+    async def get_monitor(self, monitor, stoplight=True):
+        return await self._call(newrelic.get_monitor, self.account, monitor, stoplight=stoplight)
+
+    async def get_monitors(self, stoplight=True, raw=False):
+        loop = asyncio.get_event_loop()
+        pages = asyncio.Queue()
+
+        def list_pages():
+            # The listing runs on its own thread and pool, handing pages over
+            # to the loop as they arrive, exactly like the synchronous version.
+            try:
+                with ThreadPoolExecutor(max_workers=self.concurrency) as page_executor:
+                    for page in newrelic._iter_monitor_pages(self.account, page_executor,
+                                                             self.page_size, self.concurrency):
+                        loop.call_soon_threadsafe(pages.put_nowait, page)
+            except Exception as error:
+                loop.call_soon_threadsafe(pages.put_nowait, error)
+            else:
+                loop.call_soon_threadsafe(pages.put_nowait, None)
+
+        lister = loop.run_in_executor(None, list_pages)
+
+        monitors = []
+        seen = set()
+        details = []
+        while True:
+            page = await pages.get()
+            if page is None:
+                break
+            if isinstance(page, Exception):
+                await lister
+                raise page
+            for item in page:
+                if item['id'] in seen:
+                    continue
+                seen.add(item['id'])
+                monitors.append(Monitor(item, raw=raw))
+                details.append(asyncio.ensure_future(self.get_monitor(item['id'], stoplight)))
+        await lister
+
+        results = await asyncio.gather(*details, return_exceptions=True)
+        for monitor, result in zip(monitors, results):
+            if isinstance(result, Exception):
+                monitor.fail(result)
+            else:
+                monitor.update(result)
+        return sorted(monitors, key=lambda monitor: monitor.name)
+
+    async def get_state(self, errors=None):
+        monitors = await self.get_monitors(stoplight=False)
+        return newrelic._project_state(monitors, errors)
+
+    async def get_locations(self):
+        return await self._call(newrelic.get_locations, self.account)
+
+    async def create_monitor(self, *args, **kwargs):
+        return await self._call(newrelic.create_monitor, self.account, *args, **kwargs)
+
+    async def update_monitor(self, monitor, *args, **kwargs):
+        return await self._call(newrelic.update_monitor, self.account, monitor, *args, **kwargs)
+
+    async def delete_monitor(self, monitor):
+        return await self._call(newrelic.delete_monitor, self.account, monitor)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import neres.urls as urls
+
+# Seconds a cached response is used without asking the server again. Only
+# endpoints listed here are cached.
+DEFAULT_TTLS = {
+    'MONITOR_JSON': 300,
+    'MONITOR_STOPLIGHT': 60,
+    'MONITOR_LOCATIONS': 24 * 60 * 60,
+}
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+
+
+class Cache(object):
+    """On-disk cache of GET responses, one JSON file per URL.
+
+    `read` and `write` control whether cached responses are used and whether
+    new responses are stored, which is how `--no-cache` and `--refresh` are
+    implemented. Eviction is least recently used, based on file mtimes which
+    are bumped on every hit, and happens in `prune`.
+    """
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, ttls=None, read=True, write=True):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.read = read
+        self.write = write
+        if not os.path.exists(directory):
+            os.makedirs(directory, 0o700)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def ttl(self, url):
+        return self.ttls.get(urls.endpoint(url))
+
+    def get(self, url):
+        """Return the cached entry for `url` or None.
+
+        The entry carries a `fresh` key telling whether it is still within
+        its TTL. Stale entries are returned too, so they can be revalidated.
+        """
+        ttl = self.ttl(url)
+        if not self.read or ttl is None:
+            return None
+        path = self._path(url)
+        try:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, ValueError):
+            return None
+        if entry.get('url') != url:
+            return None
+        entry['fresh'] = time.time() - entry['stored'] < ttl
+        return entry
+
+    def put(self, url, response):
+        if not self.write or self.ttl(url) is None:
+            return
+        entry = {
+            'url': url,
+            'stored': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_type': response.headers.get('Content-Type'),
+            'body': response.content.decode('utf-8'),
+        }
+        self._write(url, entry)
+
+    def touch(self, url, entry):
+        """Mark a revalidated entry as fresh again."""
+        entry = dict(entry)
+        entry.pop('fresh', None)
+        entry['stored'] = time.time()
+        self._write(url, entry)
+
+    def _write(self, url, entry):
+        # Best-effort, a cache that can't be written to shouldn't fail requests.
+        path = self._path(url)
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_path, 'w') as entry_file:
+                json.dump(entry, entry_file)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def hit(self, url):
+        try:
+            os.utime(self._path(url), None)
+        except OSError:
+            pass
+
+    def invalidate(self, url):
+        try:
+            os.remove(self._path(url))
+        except OSError:
+            pass
+
+    def prune(self):
+        """Remove least recently used entries until the cache fits max_size."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    @staticmethod
+    def response(entry):
+        """Build a requests Response out of a cached entry."""
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry['url']
+        response.encoding = 'utf-8'
+        response._content = entry['body'].encode('utf-8')
+        response.headers = CaseInsensitiveDict()
+        for header, key in [('ETag', 'etag'), ('Last-Modified', 'last_modified'),
+                            ('Content-Type', 'content_type')]:
+            if entry.get(key):
+                response.headers[header] = entry[key]
+        return response
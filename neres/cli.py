@@ -1,21 +1,48 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import csv
+import importlib.util
 import json
+import re
 import sys
 import os
-import platform
-import subprocess
+from collections import OrderedDict
 from datetime import datetime
 
 import click
-import humanize
-import yaml
-import yamlordereddictloader
-from terminaltables import SingleTable
 
-import neres.newrelic as newrelic
+import neres.defaults as defaults
 import neres.urls as urls
-from .spinner import Spinner
+from .monitor import Monitor
+from .spinner import Progress, Spinner
+
+
+def _lazy_import(name):
+    """Import module `name` when one of its attributes is first used.
+
+    Most commands need requests and friends, but `--help` and `open` don't,
+    so importing them up front makes every run slower.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+newrelic = _lazy_import('neres.newrelic')
+state = _lazy_import('neres.state')
+
+
+def _report_failed_monitors(monitors):
+    for monitor in monitors:
+        click.echo(click.style(u'Error', fg='red', bold=True) +
+                   ' fetching monitor {}: {}'.format(monitor.id, monitor.error),
+                   err=True)
 
 
 @click.command(help='Add a new monitor')
@@ -67,6 +94,67 @@ def add_monitor(ctx, name, uri, location, frequency, email, validation_string,
         raise click.ClickException(message)
 
 
+@click.command(help=('Add monitors from a YAML or CSV file. Monitors are described with the '
+                     'fields of `get-state`, ids are ignored. In CSV files separate multiple '
+                     'emails or locations with semicolons.'))
+@click.argument('specfile', type=click.File('r'))
+@click.option('--output', default='-', type=click.File('w'),
+              help='Write the IDs of the created monitors to this file. Defaults to stdout.')
+@click.option('--jobs', default=None, type=click.IntRange(1, None),
+              help='Number of monitors to create in parallel. Defaults to --concurrency.')
+@click.pass_context
+def add_monitors(ctx, specfile, output, jobs):
+    import yaml
+
+    try:
+        specs = state.load_specs(specfile)
+    except (ValueError, yaml.YAMLError) as error:
+        raise click.ClickException('Cannot read {}: {}'.format(specfile.name, error))
+
+    # Validate everything before creating anything.
+    monitors = []
+    invalid = 0
+    for number, spec in enumerate(specs, 1):
+        try:
+            monitors.append(state.validate_spec(spec))
+        except ValueError as error:
+            invalid += 1
+            click.echo('Monitor #{} ({}): {}'.format(number, spec.get('name'), error), err=True)
+    if invalid:
+        raise click.ClickException('{} invalid monitors in {}'.format(invalid, specfile.name))
+
+    with Spinner('Preparing: '):
+        referer = newrelic.new_monitor_referer(ctx.obj['ACCOUNT'])
+
+    def create(monitor):
+        status, message, data = newrelic.create_monitor(ctx.obj['ACCOUNT'], referer=referer,
+                                                        **monitor)
+        if status != 0:
+            raise click.ClickException(message)
+        return data['id']
+
+    with Progress('Creating monitors: ', len(monitors)) as progress:
+        results = newrelic.map_concurrently(create, monitors, jobs or ctx.obj['CONCURRENCY'],
+                                            callback=progress.update)
+
+    created = []
+    failed = 0
+    for monitor, monitor_id, error in results:
+        entry = OrderedDict([('name', monitor['name']), ('uri', monitor['uri'])])
+        if error:
+            failed += 1
+            entry['error'] = str(error)
+        else:
+            entry['id'] = monitor_id
+        created.append(entry)
+
+    output.write(state.dump_yaml(created))
+
+    if failed:
+        raise click.ClickException('Failed to create {} of {} monitors'.format(
+            failed, len(monitors)))
+
+
 @click.command(help='Update an existing monitor')
 @click.argument('monitor')
 @click.option('--name', default=None, help='Change the name of the monitor')
@@ -141,41 +229,37 @@ def update_monitor(ctx, monitor, **kwargs):
 @click.option('--raw', default=False, is_flag=True, help='Return raw json response')
 @click.pass_context
 def get_monitor(ctx, monitor, raw):
+    from terminaltables import SingleTable
+
     with Spinner('Fetching monitor: '):
-        monitor = newrelic.get_monitor(ctx.obj['ACCOUNT'], monitor)
+        data = newrelic.get_monitor(ctx.obj['ACCOUNT'], monitor)
 
     if raw:
-        print(json.dumps(monitor))
+        print(json.dumps(data))
         return
 
-    severity = monitor.get('severity', 0)
-    if severity == 2:
-        health = click.style(u'✔', fg='green')
-    elif severity == 1:
-        health = click.style(u'❢', fg='yellow')
-    else:
-        health = click.style(u'✖', fg='red')
-    monitor['health'] = health
+    monitor = Monitor(data)
+    health = _health(monitor)
 
-    status = monitor['status'].lower()
+    status = monitor.status.lower()
     if status in ('muted', 'disabled'):
         status = click.style(u'❢ {}'.format(status), fg='yellow')
     else:
         status = click.style(u'✔ OK', fg='green')
 
     data = [
-        ['Monitor', monitor['id']],
+        ['Monitor', monitor.id],
         ['Status', status],
         ['Health', health],
-        ['Name', monitor['name']],
-        ['URI', monitor['uri']],
-        ['Type', monitor['type']],
-        ['Locations', ', '.join(monitor['locations'])],
-        ['slaThreshold', monitor['slaThreshold']],
-        ['Emails', ', '.join(monitor['emails'])],
-        ['Frequency', monitor['frequency']],
-        ['Created', monitor['createdAt']],
-        ['Modified', monitor['modifiedAt']],
+        ['Name', monitor.name],
+        ['URI', monitor.uri],
+        ['Type', monitor.type],
+        ['Locations', ', '.join(monitor.locations)],
+        ['slaThreshold', monitor.slaThreshold],
+        ['Emails', ', '.join(monitor.emails)],
+        ['Frequency', monitor.frequency],
+        ['Created', monitor.createdAt],
+        ['Modified', monitor.modifiedAt],
 
     ]
 
@@ -206,10 +290,77 @@ def delete_monitor(ctx, monitor, confirm):
     print(click.style(u'OK', fg='green', bold=True))
 
 
+@click.command(help=('Delete multiple monitors. Pass monitor IDs as arguments, `-` to read '
+                     'them from stdin (combine with --confirm) or use --match.'))
+@click.argument('monitors', nargs=-1)
+@click.option('--match', default=None,
+              help='Delete all monitors with names matching this regular expression')
+@click.option('--confirm', default=None, type=int,
+              help='Skip confirmation prompt by supplying the number of monitors to delete')
+@click.option('--jobs', default=None, type=click.IntRange(1, None),
+              help='Number of monitors to delete in parallel. Defaults to --concurrency.')
+@click.pass_context
+def delete_monitors(ctx, monitors, match, confirm, jobs):
+    monitors = list(monitors)
+    if '-' in monitors:
+        monitors.remove('-')
+        monitors.extend(click.get_text_stream('stdin').read().split())
+
+    if match:
+        try:
+            pattern = re.compile(match)
+        except re.error as error:
+            raise click.ClickException('Invalid --match expression: {}'.format(error))
+        with Spinner('Fetching monitors: '):
+            listing = newrelic.get_monitors(ctx.obj['ACCOUNT'], ctx.obj['CONCURRENCY'],
+                                            page_size=ctx.obj['PAGE_SIZE'], details=False)
+        monitors.extend(monitor.id for monitor in listing if pattern.search(monitor.name))
+
+    # Remove duplicates, keep the order.
+    monitors = list(OrderedDict.fromkeys(monitors))
+    if not monitors:
+        raise click.ClickException('No monitors to delete')
+
+    if confirm is None:
+        confirm = click.prompt('''
+ ! WARNING: Destructive Action
+ ! This command will destroy {count} monitors:
+ !   {monitors}
+ ! To proceed, type "{count}" or
+   re-run this command with --confirm={count}
+
+'''.format(count=len(monitors), monitors='\n !   '.join(monitors)), prompt_suffix='> ',
+            type=int)
+    if confirm != len(monitors):
+        print('abort')
+        sys.exit(1)
+
+    def delete(monitor):
+        newrelic.delete_monitor(ctx.obj['ACCOUNT'], monitor)
+
+    with Progress('Deleting monitors: ', len(monitors)) as progress:
+        results = newrelic.map_concurrently(delete, monitors, jobs or ctx.obj['CONCURRENCY'],
+                                            callback=progress.update)
+
+    failed = 0
+    for monitor, _, error in results:
+        if error:
+            failed += 1
+            print('{} {} {}'.format(monitor, click.style(u'Error', fg='red', bold=True), error))
+        else:
+            print('{} {}'.format(monitor, click.style(u'OK', fg='green', bold=True)))
+
+    if failed:
+        raise click.ClickException('Failed to delete {} of {} monitors'.format(
+            failed, len(monitors)))
+
+
 @click.command(help='List available monitor locations')
 @click.option('--raw', default=False, is_flag=True, help='Return raw json response')
 @click.pass_context
 def list_locations(ctx, raw):
+    from terminaltables import SingleTable
+
     with Spinner('Fetching locations: '):
         locations = newrelic.get_locations(ctx.obj['ACCOUNT'])
 
@@ -251,22 +402,17 @@ def list_locations(ctx, raw):
     print(table.table)
 
 
-@click.command(help='List monitors')
-@click.option('--ids-only', default=False, is_flag=True, help='List monitor IDs only')
-@click.option('--raw', default=False, is_flag=True, help='Return raw json response')
-@click.pass_context
-def list_monitors(ctx, ids_only, raw):
-    with Spinner('Fetching monitors: '):
-        monitors = newrelic.get_monitors(ctx.obj['ACCOUNT'])
+def _health(monitor):
+    if monitor.severity == 2:
+        return click.style(u'✔', fg='green')
+    elif monitor.severity == 1:
+        return click.style(u'❢', fg='yellow')
+    return click.style(u'✖', fg='red')
 
-    if raw:
-        print(json.dumps(monitors))
-        return
 
-    if ids_only:
-        for monitor in monitors:
-            print(monitor['id'])
-        return
+def _print_monitors_table(monitors):
+    import humanize
+    from terminaltables import SingleTable
 
     data = [[
         '#',
@@ -283,38 +429,25 @@ def list_monitors(ctx, ids_only, raw):
         'Notif\nEmails',
     ]]
 
-    for monitor in monitors:
-        severity = monitor.get('severity', 0)
-        if severity == 2:
-            health = click.style(u'✔', fg='green')
-        elif severity == 1:
-            health = click.style(u'❢', fg='yellow')
-        else:
-            health = click.style(u'✖', fg='red')
-        monitor['health'] = health
-
-        status = monitor['status'].lower()
-        if status in ('muted', 'disabled'):
+    for number, monitor in enumerate(monitors, 1):
+        if monitor.status.lower() in ('muted', 'disabled'):
             status = click.style(u'❢', fg='yellow')
         else:
             status = click.style(u'✔', fg='green')
-        monitor['status'] = status
-
-    for number, monitor in enumerate(monitors, 1):
 
         data.append([
             number,
-            monitor['health'],
-            monitor['status'],
-            monitor['name'],
-            monitor['id'],
-            '{:.1f}%'.format(100 * monitor.get('success_ratio', 0)),
-            humanize.naturalsize(monitor.get('avg_size', 0), binary=True),
-            '{:.1f} ms'.format(monitor.get('load_time_50th_pr', 0)),
-            '{:.1f} ms'.format(monitor.get('load_time_95th_pr', 0)),
-            '{} min'.format(monitor['frequency']),
-            len(monitor['locations']),
-            len(monitor['emails'])
+            _health(monitor),
+            status,
+            monitor.name,
+            monitor.id,
+            '{:.1f}%'.format(100 * (monitor.success_ratio or 0)),
+            humanize.naturalsize(monitor.avg_size or 0, binary=True),
+            '{:.1f} ms'.format(monitor.load_time_50th_pr or 0),
+            '{:.1f} ms'.format(monitor.load_time_95th_pr or 0),
+            '{} min'.format(monitor.frequency),
+            len(monitor.locations),
+            len(monitor.emails),
         ])
 
     table = SingleTable(data)
@@ -331,10 +464,91 @@ def list_monitors(ctx, ids_only, raw):
     print(table.table.encode('utf-8'))
 
 
+LIST_FIELDS = ['id', 'name', 'status', 'severity', 'success_ratio', 'avg_size',
+               'load_time_50th_pr', 'load_time_95th_pr', 'frequency', 'locations', 'emails',
+               'error']
+
+
+def _stream_monitors(monitors, output_format):
+    if output_format == 'ndjson':
+        for monitor in monitors:
+            print(json.dumps(monitor.raw), flush=True)
+        return
+
+    delimiter = ',' if output_format == 'csv' else '\t'
+    writer = csv.writer(sys.stdout, delimiter=delimiter, lineterminator='\n')
+    writer.writerow(LIST_FIELDS)
+    for monitor in monitors:
+        row = []
+        for field in LIST_FIELDS:
+            value = getattr(monitor, field)
+            if value is None:
+                value = ''
+            elif isinstance(value, list):
+                value = ';'.join(value)
+            row.append(value)
+        writer.writerow(row)
+        sys.stdout.flush()
+
+
+@click.command(help='List monitors')
+@click.option('--ids-only', default=False, is_flag=True, help='List monitor IDs only')
+@click.option('--raw', default=False, is_flag=True, help='Return raw json response')
+@click.option('--format', 'output_format', default='table',
+              type=click.Choice(['table', 'ndjson', 'csv', 'tsv']),
+              help=('Output format. Except for `table`, monitors are printed as soon as they '
+                    'are fetched. Defaults to `table`.'))
+@click.option('--sort', default=False, is_flag=True,
+              help='Sort streamed monitors by name. Waits until all monitors are fetched.')
+@click.pass_context
+def list_monitors(ctx, ids_only, raw, output_format, sort):
+    failed = []
+
+    if ids_only and not raw:
+        # Ids come with the listing, don't fetch the details of every monitor.
+        monitors = newrelic.iter_monitors(ctx.obj['ACCOUNT'], ctx.obj['CONCURRENCY'],
+                                          page_size=ctx.obj['PAGE_SIZE'], details=False)
+        if sort:
+            monitors = sorted(monitors, key=lambda x: x.name)
+        for monitor in monitors:
+            print(monitor.id, flush=True)
+    elif output_format != 'table' and not raw:
+        monitors = newrelic.iter_monitors(ctx.obj['ACCOUNT'], ctx.obj['CONCURRENCY'],
+                                          page_size=ctx.obj['PAGE_SIZE'],
+                                          raw=output_format == 'ndjson')
+        if sort:
+            monitors = sorted(monitors, key=lambda x: x.name)
+
+        def track_failures(monitors):
+            for monitor in monitors:
+                if monitor.error is not None:
+                    failed.append(monitor)
+                yield monitor
+
+        _stream_monitors(track_failures(monitors), output_format)
+    else:
+        with Spinner('Fetching monitors: '):
+            monitors = newrelic.get_monitors(ctx.obj['ACCOUNT'], ctx.obj['CONCURRENCY'],
+                                             page_size=ctx.obj['PAGE_SIZE'], raw=raw)
+        failed = [monitor for monitor in monitors if monitor.error is not None]
+
+        if raw:
+            print(json.dumps([monitor.raw for monitor in monitors]))
+        else:
+            _print_monitors_table(monitors)
+
+    if failed:
+        _report_failed_monitors(failed)
+        ctx.exit(1)
+
+
 @click.command(help='Open monitor in Web browser')
 @click.argument('monitor')
 @click.pass_context
 def open_monitor(ctx, monitor):
+    import platform
+    import subprocess
+
     url = urls.MONITOR.format(account=ctx.obj['ACCOUNT'], monitor=monitor)
     if platform.system() == 'Windows':
         os.startfile(url)
@@ -346,9 +560,13 @@ def open_monitor(ctx, monitor):
 
 @click.command(help='List accounts')
 @click.option('--raw', is_flag=True, default=False, help='Return raw json response')
-def list_accounts(raw):
+@click.option('--refresh', is_flag=True, default=False,
+              help='Fetch the list of accounts again instead of using the saved one')
+def list_accounts(raw, refresh):
+    from terminaltables import SingleTable
+
     with Spinner('Fetching accounts: '):
-        accounts = newrelic.get_accounts()
+        accounts = newrelic.get_accounts(refresh=refresh)
 
     if raw:
         for account in accounts:
@@ -382,63 +600,206 @@ def login(ctx):
     print(click.style(u'OK', fg='green', bold=True))
 
 
-@click.command(help='Update from state')
+@click.command(help='Update from state. The statefile can be in YAML or JSON.')
 @click.argument('statefile', type=click.File('rb'))
 @click.option('--apply', default=False, is_flag=True)
+@click.option('--jobs', default=None, type=click.IntRange(1, None),
+              help='Number of monitors to update in parallel. Defaults to --concurrency.')
 @click.pass_context
-def update_from_statefile(ctx, apply, statefile):
+def update_from_statefile(ctx, apply, jobs, statefile):
+    import yaml
+
+    try:
+        here_data = state.load_state(statefile)
+    except (ValueError, yaml.YAMLError) as error:
+        raise click.ClickException('Cannot read {}: {}'.format(statefile.name, error))
+
     if not apply:
         print('This is a dry run. Run with --apply to make the changes.\n')
 
+    # Always compare against the current state, never a cached one.
+    if newrelic.session.cache:
+        newrelic.session.cache.read = False
+
     with Spinner('Getting current state: '):
-        there_data = newrelic.get_state(ctx.obj['ACCOUNT'])
-    here_data = yaml.load(statefile)
-
-    changes = 0
-    for monitor in here_data:
-        for there_monitor in there_data:
-            if there_monitor['id'] == monitor['id']:
-                break
-        else:
-            print('Monitor {} only exists in statefile, skipping.'.format(monitor['id']))
-            continue
-
-        if there_monitor != monitor:
-            monitor_id = monitor.pop('id')
-            with Spinner('Updating monitor {}: '.format(monitor_id), remove_message=False):
-                if apply:
-                    status, message, _ = newrelic.update_monitor(ctx.obj['ACCOUNT'],
-                                                                 monitor_id,
-                                                                 **monitor)
-                    if status == 0:
-                        print(click.style(u'OK', fg='green', bold=True))
-                    else:
-                        print(click.style(u'Error', fg='red', bold=True))
-                        raise click.ClickException(message)
-            changes += 1
-
-    if changes == 0:
+        # Updates are made on the monitor documents, keep them.
+        monitors = newrelic.get_monitors(ctx.obj['ACCOUNT'], ctx.obj['CONCURRENCY'],
+                                         stoplight=False, page_size=ctx.obj['PAGE_SIZE'],
+                                         raw=True)
+    failed = [monitor for monitor in monitors if monitor.error is not None]
+    if failed:
+        _report_failed_monitors(failed)
+        raise click.ClickException('Cannot compare state, failed to fetch {} monitors'.format(
+            len(failed)))
+
+    changes, missing = state.reconcile(here_data, monitors)
+    for monitor_id in missing:
+        print('Monitor {} only exists in statefile, skipping.'.format(monitor_id))
+
+    if not changes:
         print('No changes made.')
-    else:
-        print('Successfully updated {} monitors'.format(changes))
+        return
+
+    for monitor, monitor_changes in changes:
+        print('Monitor {} ({}):'.format(monitor.id, monitor.name))
+        for line in state.format_changes(monitor_changes):
+            print('  ' + line)
+
+    if not apply:
+        print('\n{} monitors will be updated'.format(len(changes)))
+        return
+
+    def update(change):
+        monitor, monitor_changes = change
+        status, message, _ = newrelic.update_monitor(ctx.obj['ACCOUNT'], monitor.id,
+                                                     base=monitor.raw,
+                                                     **state.update_arguments(monitor_changes))
+        if status != 0:
+            raise click.ClickException(message)
+
+    with Progress('Updating monitors: ', len(changes)) as progress:
+        results = newrelic.map_concurrently(update, changes, jobs or ctx.obj['CONCURRENCY'],
+                                            callback=progress.update)
+
+    failed = [(monitor, error) for (monitor, _), _, error in results if error]
+    print('Successfully updated {} monitors'.format(len(changes) - len(failed)))
+    if failed:
+        print(click.style(u'Failed to update {} monitors:'.format(len(failed)),
+                          fg='red', bold=True))
+        for monitor, error in failed:
+            print(' {}: {}'.format(monitor.id, error))
+        ctx.exit(1)
 
 
 @click.command(help='Get state')
+@click.option('--format', 'output_format', default='yaml', type=click.Choice(['yaml', 'json']),
+              help='Format of the state. JSON is much faster to read and write. Default `yaml`.')
+@click.option('--incremental', default=False, is_flag=True,
+              help=('Only fetch monitors added or modified since the last incremental run, '
+                    'reusing the rest from a local snapshot.'))
+@click.option('--verify', default=False, is_flag=True,
+              help=('With --incremental, fetch all monitors too and fail if the state differs '
+                    'from the incremental one.'))
 @click.pass_context
-def get_state(ctx, return_data=False):
+def get_state(ctx, output_format, incremental, verify):
+    if verify and not incremental:
+        raise click.ClickException('--verify only works with --incremental')
+
+    failed = []
+    snapshot = None
+    if incremental:
+        snapshot_path = os.path.expanduser('~/.config/neres/{}/snapshots/{}.json'.format(
+            ctx.obj['ENVIRONMENT'], ctx.obj['ACCOUNT']))
+        snapshot = state.load_snapshot(snapshot_path)
+        # Modified monitors have to come from NewRelic, not the cache.
+        if newrelic.session.cache:
+            newrelic.session.cache.read = False
+
+    writer = state.StateWriter(output_format)
     with Spinner('Fetching state: '):
-        state = newrelic.get_state(ctx.obj['ACCOUNT'])
-
-    print('# Generated on {}'.format(datetime.utcnow().isoformat()))
-    print(yaml.dump(
-        state,
-        allow_unicode=True,
-        default_flow_style=False,
-        Dumper=yamlordereddictloader.SafeDumper,
-    ))
-
+        for monitor_state in newrelic.iter_state(ctx.obj['ACCOUNT'], ctx.obj['CONCURRENCY'],
+                                                 failed, ctx.obj['PAGE_SIZE'], snapshot):
+            writer.add(monitor_state)
+    if incremental:
+        state.save_snapshot(snapshot_path, snapshot)
+
+    if verify:
+        full_writer = state.StateWriter(output_format)
+        full_failed = []
+        with Spinner('Verifying state: '):
+            for monitor_state in newrelic.iter_state(ctx.obj['ACCOUNT'], ctx.obj['CONCURRENCY'],
+                                                     full_failed, ctx.obj['PAGE_SIZE']):
+                full_writer.add(monitor_state)
+        # Monitors that failed to fetch in either run can't be compared.
+        skip = set(monitor.id for monitor in failed)
+        failed.extend(monitor for monitor in full_failed if monitor.id not in skip)
+        skip.update(monitor.id for monitor in full_failed)
+
+        incremental_states, full_states = writer.by_id(), full_writer.by_id()
+        different = sorted(monitor_id for monitor_id in set(incremental_states) | set(full_states)
+                           if monitor_id not in skip and
+                           incremental_states.get(monitor_id) != full_states.get(monitor_id))
+        if different:
+            # Start over with a full fetch next time.
+            os.remove(snapshot_path)
+            for monitor_id in different:
+                click.echo('Monitor {} differs from a full fetch'.format(monitor_id), err=True)
+            raise click.ClickException('Incremental state differs for {} monitors'.format(
+                len(different)))
+        click.echo('Incremental state is identical to a full fetch', err=True)
+
+    if output_format == 'yaml':
+        print('# Generated on {}'.format(datetime.utcnow().isoformat()))
+    writer.write(sys.stdout)
+
+    if failed:
+        _report_failed_monitors(failed)
+        ctx.exit(1)
+
+
+def _print_summary():
+    if newrelic.session.retries:
+        click.echo('Retried {} failed requests'.format(newrelic.session.retries), err=True)
+
+
+def _print_stats(request_stats):
+    import humanize
+    from terminaltables import SingleTable
+
+    data = [['Endpoint', 'Requests', 'p50', 'p95', 'Max', 'Size', 'Retries', 'Errors']]
+    for name, count, p50, p95, slowest, size, retries, errors in request_stats.summary():
+        data.append([
+            name,
+            count,
+            '{:.0f} ms'.format(p50 * 1000),
+            '{:.0f} ms'.format(p95 * 1000),
+            '{:.0f} ms'.format(slowest * 1000),
+            humanize.naturalsize(size, binary=True),
+            retries,
+            errors,
+        ])
 
-@click.group()
+    table = SingleTable(data)
+    table.title = click.style('Requests', fg='black')
+    for i in range(1, 8):
+        table.justify_columns[i] = 'right'
+    click.echo(table.table, err=True)
+
+    for name, value in sorted(newrelic.session.stats().items()):
+        click.echo('{}: {}'.format(name, value), err=True)
+
+
+class Group(click.Group):
+    def invoke(self, ctx):
+        clock = ctx.params.get('profile_clock')
+        path = ctx.params.get('profile')
+        if not (clock or path):
+            return self._invoke(ctx)
+
+        from neres.profiling import Profiler
+
+        profiler = Profiler(clock or 'wall')
+        profiler.start()
+        try:
+            return self._invoke(ctx)
+        finally:
+            profiler.stop()
+            if path:
+                profiler.dump(path)
+            profiler.report(sys.stderr)
+
+    def _invoke(self, ctx):
+        try:
+            return super(Group, self).invoke(ctx)
+        except Exception as error:
+            # Only requests can raise LoginRequired, don't import them for this.
+            session = sys.modules.get('neres.session')
+            if session and isinstance(error, session.LoginRequired):
+                raise click.ClickException('Session expired, login again')
+            raise
+
+
+@click.group(cls=Group)
 @click.option('--email', help='New Relic login email')
 @click.option('--password', help='New Relic login password')
 @click.option('--account', help=('New Relic account to work on. You can get a list of accounts '
@@ -446,35 +807,117 @@ def get_state(ctx, return_data=False):
 @click.option('--environment', default='newrelic',
               help=('Default `newrelic`. Define different environments for '
                     'different New Relic accounts.'))
+@click.option('--concurrency', default=defaults.DEFAULT_CONCURRENCY, envvar='NERES_CONCURRENCY',
+              type=click.IntRange(1, None),
+              help=('Maximum number of parallel requests. Defaults to {}.'.format(
+                  defaults.DEFAULT_CONCURRENCY)))
+@click.option('--min-concurrency', default=1, envvar='NERES_MIN_CONCURRENCY',
+              type=click.IntRange(1, None),
+              help=('Parallel requests are adjusted between this and --concurrency depending '
+                    'on how fast NewRelic responds. Defaults to 1.'))
+@click.option('--page-size', default=defaults.DEFAULT_PAGE_SIZE, envvar='NERES_PAGE_SIZE',
+              type=click.IntRange(1, None),
+              help=('Number of monitors to request per listing page. Smaller pages are used '
+                    'if the server caps it. Defaults to {}.'.format(defaults.DEFAULT_PAGE_SIZE)))
+@click.option('--session-ttl', default=defaults.DEFAULT_SESSION_TTL, envvar='NERES_SESSION_TTL',
+              type=click.IntRange(0, None),
+              help=('Seconds to trust a verified login session without checking it again. '
+                    'Set to 0 to always check. Defaults to {}.'.format(
+                        defaults.DEFAULT_SESSION_TTL)))
+@click.option('--retries', default=3, envvar='NERES_RETRIES', type=click.IntRange(0, None),
+              help='Times to retry a failed request. Defaults to 3.')
+@click.option('--retry-budget', default=100, envvar='NERES_RETRY_BUDGET',
+              type=click.IntRange(0, None),
+              help='Maximum number of retries over all requests of a command. Defaults to 100.')
+@click.option('--no-cache', default=False, is_flag=True,
+              help='Do not read or write the local cache of monitors and locations.')
+@click.option('--refresh', default=False, is_flag=True,
+              help='Ignore cached monitors and locations and fetch them again.')
+@click.option('--stats', 'show_stats', default=False, is_flag=True,
+              help='Print the number, latency and size of requests per endpoint at exit.')
+@click.option('--trace', default=None, type=click.File('w'),
+              help='Write every request made as a JSON line to this file.')
+@click.option('--profile', default=None, type=click.Path(dir_okay=False, writable=True),
+              envvar='NERES_PROFILE_FILE', allow_from_autoenv=False,
+              help='Profile the command and write the pstats to this file.')
+@click.option('--profile-clock', default=None, type=click.Choice(['cpu', 'wall']),
+              envvar='NERES_PROFILE',
+              help=('Profile the command measuring CPU or wall time and print the functions '
+                    'taking most time. Defaults to `wall` when --profile is used.'))
 @click.pass_context
-def cli(ctx, email, password, account, environment):
+def cli(ctx, email, password, account, environment, concurrency, min_concurrency, page_size,
+        session_ttl, retries, retry_budget, no_cache, refresh, show_stats, trace, profile,
+        profile_clock):
+    ctx.obj = {}
+    ctx.obj['ACCOUNT'] = account
+    ctx.obj['EMAIL'] = email
+    ctx.obj['PASSWORD'] = password
+    ctx.obj['CONCURRENCY'] = concurrency
+    ctx.obj['PAGE_SIZE'] = page_size
+    ctx.obj['ENVIRONMENT'] = environment
+
+    if ctx.invoked_subcommand == 'open' and account:
+        # Nothing to fetch, the browser takes care of logging in.
+        return
+
+    from neres.session import AdaptiveLimiter
+    from neres.stats import RequestStats, Tracer
+
     cookiejar = os.path.expanduser('~/.config/neres/{}.cookies'.format(environment))
     if not os.path.exists(os.path.dirname(cookiejar)):
         os.makedirs(os.path.dirname(cookiejar), 0o700)
     newrelic.initialize_cookiejar(cookiejar)
-
+    newrelic.initialize_account_cache(
+        os.path.expanduser('~/.config/neres/{}.accounts'.format(environment)))
+    newrelic.initialize_session_state(
+        os.path.expanduser('~/.config/neres/{}.session'.format(environment)))
+    newrelic.session.start_command()
+    ctx.call_on_close(newrelic.session.end_command)
+    newrelic.session.configure_pool(concurrency)
+    newrelic.session.retry_policy.retries = retries
+    newrelic.session.retry_policy.budget = retry_budget
+    newrelic.session.limiter = AdaptiveLimiter(floor=min(min_concurrency, concurrency),
+                                               ceiling=concurrency)
+    ctx.call_on_close(_print_summary)
+
+    newrelic.session.observers = []
+    if show_stats:
+        request_stats = RequestStats()
+        newrelic.session.observers.append(request_stats)
+        ctx.call_on_close(lambda: _print_stats(request_stats))
+    if trace:
+        newrelic.session.observers.append(Tracer(trace))
+
+    newrelic.session.cache = None
+    if not no_cache:
+        cache = newrelic.initialize_cache(
+            os.path.expanduser('~/.config/neres/{}/cache'.format(environment)),
+            read=not refresh)
+        ctx.call_on_close(cache.prune)
+
+    newrelic.initialize_credentials(email, password)
     if ctx.invoked_subcommand != 'login':
         with Spinner('Authorizing: '):
-            if all([email, password]):
-                newrelic.login(email, password)
-            else:
-                if not newrelic.check_if_logged_in():
+            # With credentials only login when the session isn't usable,
+            # expiring later on is handled by the session itself.
+            credentials = all([email, password])
+            if not newrelic.check_if_logged_in(max_age=session_ttl,
+                                               email=email if credentials else None):
+                if not credentials:
                     raise click.ClickException('Login first')
+                newrelic.login(email, password)
 
         if not account and ctx.invoked_subcommand != 'list-accounts':
-            account = newrelic.get_accounts()[0]['id']
-
-    ctx.obj = {}
-    ctx.obj['ACCOUNT'] = account
-    ctx.obj['EMAIL'] = email
-    ctx.obj['PASSWORD'] = password
+            ctx.obj['ACCOUNT'] = newrelic.get_accounts()[0]['id']
 
 
 cli.add_command(list_monitors, name='list-monitors')
 cli.add_command(list_locations, name='list-locations')
 cli.add_command(delete_monitor, name='delete-monitor')
+cli.add_command(delete_monitors, name='delete-monitors')
 cli.add_command(get_monitor, name='get-monitor')
 cli.add_command(add_monitor, name='add-monitor')
+cli.add_command(add_monitors, name='add-monitors')
 cli.add_command(update_monitor, name='update-monitor')
 cli.add_command(list_accounts, name='list-accounts')
 cli.add_command(open_monitor, name='open')
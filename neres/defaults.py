@@ -0,0 +1,5 @@
+# Defaults shared by the API and the command line. Kept apart from
+# neres.newrelic so that the cli can use them without importing requests.
+DEFAULT_CONCURRENCY = 8
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_SESSION_TTL = 300
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# Monitor metadata keys behind the options of get-state.
+BYPASS_HEAD = 'nr.synthetics.metadata.job.options.simple.bypass.head'
+RESPONSE_VALIDATION = 'nr.synthetics.metadata.job.options.response-validation'
+TLS_VALIDATION = 'nr.synthetics.monitor.tls-validation'
+REDIRECT_IS_FAILURE = 'nr.synthetics.metadata.job.options.simple.redirect.is.failure'
+
+
+class Monitor(object):
+    """A Synthetics monitor, holding only the fields neres uses.
+
+    Monitors are built from the listing and updated with their details and
+    stoplight as they arrive. The JSON they are built from is only kept, in
+    `raw`, when asked to, e.g. for `--raw` output or to update the monitor.
+    """
+    # Fields copied as they are from the JSON documents of NewRelic.
+    FIELDS = ('id', 'name', 'type', 'status', 'uri', 'frequency', 'locations', 'emails',
+              'slaThreshold', 'createdAt', 'modifiedAt',
+              'severity', 'success_ratio', 'avg_size', 'load_time_50th_pr', 'load_time_95th_pr')
+
+    __slots__ = FIELDS + ('validation_string', 'bypass_head_request', 'verify_ssl',
+                          'redirect_is_failure', 'error', 'raw')
+
+    def __init__(self, data=None, raw=False):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.locations = []
+        self.emails = []
+        self.validation_string = False
+        self.bypass_head_request = False
+        self.verify_ssl = False
+        self.redirect_is_failure = False
+        self.error = None
+        self.raw = {} if raw else None
+        if data:
+            self.update(data)
+
+    def __repr__(self):
+        return '<Monitor {} {!r}>'.format(self.id, self.name)
+
+    def update(self, data):
+        """Merge a JSON document of the monitor, e.g. its details or stoplight."""
+        for field in self.FIELDS:
+            if field in data:
+                setattr(self, field, data[field])
+        if 'metadata' in data:
+            self._parse_metadata(data['metadata'] or {})
+        if self.raw is not None:
+            self.raw.update(data)
+
+    def _parse_metadata(self, metadata):
+        self.bypass_head_request = metadata.get(BYPASS_HEAD) == 'true'
+        self.validation_string = metadata.get(RESPONSE_VALIDATION, False)
+        self.verify_ssl = bool(metadata.get(TLS_VALIDATION))
+        self.redirect_is_failure = bool(metadata.get(REDIRECT_IS_FAILURE))
+
+    def fail(self, error):
+        """Record that fetching the details of the monitor failed."""
+        self.error = str(error)
+        if self.raw is not None:
+            self.raw['error'] = self.error
@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
+import copy
 import re
 import os
+import time
 from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from http.cookiejar import LWPCookieJar
 
 import json
@@ -9,10 +14,21 @@ import requests
 
 import neres.urls as urls
 import neres.session as session
+from neres.cache import Cache
+from neres.monitor import Monitor
+from neres.defaults import DEFAULT_CONCURRENCY, DEFAULT_PAGE_SIZE
 
 session = session.Session()
 
 
+# File to keep the list of accounts in, see initialize_account_cache.
+account_cache = None
+# File recording when the session was last verified, see initialize_session_state.
+session_state = None
+# Email and password to login again with if the session expires, see initialize_credentials.
+credentials = None
+
+
 def initialize_cookiejar(cookiejar):
     session.cookies = LWPCookieJar(cookiejar)
     if not os.path.exists(cookiejar):
@@ -22,15 +38,115 @@ def initialize_cookiejar(cookiejar):
         session.cookies.load(ignore_discard=True)
 
 
-def check_if_logged_in():
+def initialize_account_cache(path):
+    global account_cache
+    account_cache = path
+
+
+def initialize_session_state(path):
+    global session_state
+    session_state = path
+
+
+def initialize_credentials(email, password):
+    global credentials
+    credentials = (email, password) if email and password else None
+
+
+def _read_session_state():
+    if not session_state:
+        return {}
+    try:
+        with open(session_state) as state_file:
+            data = json.load(state_file)
+    except (IOError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _mark_session_verified(email=None):
+    if not session_state:
+        return
+    data = _read_session_state()
+    data['verified_at'] = time.time()
+    if email:
+        data['email'] = email
+    with open(session_state, 'w') as state_file:
+        json.dump(data, state_file)
+    os.chmod(session_state, 0o600)
+
+
+def _session_recently_verified(max_age):
+    if not max_age:
+        return False
+
+    verified_at = _read_session_state().get('verified_at')
+    if verified_at is None:
+        return False
+
+    now = time.time()
+    if now - verified_at > max_age:
+        return False
+
+    cookies = list(session.cookies)
+    if not cookies:
+        return False
+    return all(cookie.expires is None or cookie.expires > now for cookie in cookies)
+
+
+def _reauthenticate():
+    # Our session expired while running a command. It may have been a fluke,
+    # otherwise login again if we have the credentials to do so.
+    if check_if_logged_in():
+        return True
+
+    email, password = credentials or (os.environ.get('NERES_EMAIL'),
+                                      os.environ.get('NERES_PASSWORD'))
+    if email and password:
+        login(email, password)
+        return True
+
+    if session_state and os.path.exists(session_state):
+        os.remove(session_state)
+    return False
+
+
+session.reauthenticate = _reauthenticate
+
+
+def initialize_cache(directory, read=True, write=True):
+    session.cache = Cache(directory, read=read, write=write)
+    return session.cache
+
+
+def _invalidate_monitor(account, monitor):
+    session.invalidate(urls.MONITOR_JSON.format(account=account, monitor=monitor))
+    session.invalidate(urls.MONITOR_STOPLIGHT.format(account=account, monitor=monitor))
+
+
+def check_if_logged_in(max_age=0, email=None):
+    """Check whether we have a valid session.
+
+    The check is skipped if the session was verified less than `max_age`
+    seconds ago and none of its cookies has expired since. With `email` the
+    session must also be that of this user.
+    """
+    if email and _read_session_state().get('email') != email:
+        return False
+    if _session_recently_verified(max_age):
+        return True
+
+    session.forget(urls.IDLE)
     response = session.get(urls.IDLE, allow_redirects=False)
     response.raise_for_status()
     if response.status_code == 200:
+        _mark_session_verified()
         return True
     return False
 
 
 def login(email, password):
+    previous_email = _read_session_state().get('email')
     session.cookies.clear()
     response = session.get(urls.LOGIN)
     response.raise_for_status()
@@ -55,48 +171,184 @@ def login(email, password):
     if b'login_email' in response.content:
         raise Exception('Login Failed')
     session.cookies.save(ignore_discard=True)
+    _mark_session_verified(email)
+    # Responses fetched before logging in belong to the old session.
+    session.forget()
+    # The saved accounts are those of the previous user.
+    if email != previous_email and account_cache and os.path.exists(account_cache):
+        os.remove(account_cache)
+
+
+def map_concurrently(function, items, concurrency=DEFAULT_CONCURRENCY, callback=None):
+    """Call `function` for each item using a bounded pool of worker threads.
+
+    Returns a list of (item, result, error) tuples in the order of `items`. A
+    failing call sets `error` to the raised exception instead of aborting the
+    rest of the work. `callback` is called with each tuple as soon as it's
+    available, e.g. to report progress.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(function, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = (items[index], future.result(), None)
+            except Exception as error:
+                result = (items[index], None, error)
+            results[index] = result
+            if callback:
+                callback(result)
+
+    return [results[index] for index in range(len(items))]
+
+
+def _get_monitors_page(account, offset, limit):
+    url = urls.MONITORS_V2.format(account=account, offset=offset, limit=limit)
+    response = session.get(url)
+    response.raise_for_status()
+    return response.json()
 
 
-def get_monitors(account):
-    offset = 0
-    monitors = []
+def _listing_total(page):
+    for key in ('count', 'total'):
+        if isinstance(page.get(key), int):
+            return page[key]
+    return None
+
+
+def _cancel(futures):
+    for future in futures:
+        future.cancel()
+
+
+def _iter_monitor_pages(account, executor, page_size=DEFAULT_PAGE_SIZE,
+                        concurrency=DEFAULT_CONCURRENCY):
+    """Yield the pages of the monitor listing as they arrive.
+
+    The first page tells us whether the server honored `page_size` and, if
+    the response carries it, the total number of monitors. With a total all
+    remaining pages are fetched in parallel. Without it pages are fetched in
+    speculative windows of offsets that double in size, up to `concurrency`,
+    until a short page marks the end of the listing.
+    """
+    first = _get_monitors_page(account, 0, page_size)
+    data = first.get('data') or []
+    yield data
+    if not data:
+        return
+
+    total = _listing_total(first)
+    if len(data) < page_size:
+        if total is not None and total <= len(data):
+            return
+        # Either this was the only page or the server caps the page size.
+        # Assume the latter, a single extra request tells them apart.
+        page_size = len(data)
+
+    offset = len(data)
+    if total is not None:
+        futures = [executor.submit(_get_monitors_page, account, page_offset, page_size)
+                   for page_offset in range(offset, total, page_size)]
+        try:
+            for future in as_completed(futures):
+                yield future.result().get('data') or []
+        finally:
+            _cancel(futures)
+        return
 
+    window = 1
     while True:
-        url = urls.MONITORS_V2.format(account=account, offset=offset)
-        response = session.get(url)
-        response.raise_for_status()
-        data = response.json().get('data')
-        if not data:
-            break
-        monitors.extend(data)
-        offset += 15
+        futures = [executor.submit(_get_monitors_page, account, offset + i * page_size, page_size)
+                   for i in range(window)]
+        last_page = False
+        try:
+            for future in as_completed(futures):
+                data = future.result().get('data') or []
+                if len(data) < page_size:
+                    last_page = True
+                yield data
+        finally:
+            _cancel(futures)
+        if last_page:
+            return
+        offset += window * page_size
+        window = min(window * 2, concurrency)
+
+
+def iter_monitors(account, concurrency=DEFAULT_CONCURRENCY, stoplight=True,
+                  page_size=DEFAULT_PAGE_SIZE, details=True, raw=False):
+    """Yield Monitors, in no particular order, as soon as their details arrive.
+
+    Monitors whose details could not be fetched have their `error` set. With
+    `raw` the JSON documents of each monitor are kept in its `raw` dict.
+    `details` can also be a function telling whether to fetch the details of
+    a Monitor built from the listing, otherwise it's yielded as it is.
+    """
+    seen = set()
+    pending = {}
+
+    # Pages and monitor details use separate pools so that the listing is
+    # never stuck behind the detail requests of the pages before it.
+    with ThreadPoolExecutor(max_workers=concurrency) as page_executor, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pages = _iter_monitor_pages(account, page_executor, page_size, concurrency)
+        try:
+            for page in pages:
+                for item in page:
+                    # Pages fetched in parallel may overlap if monitors are
+                    # added or removed while we list them.
+                    if item['id'] in seen:
+                        continue
+                    seen.add(item['id'])
+                    monitor = Monitor(item, raw=raw)
+                    if not (details(monitor) if callable(details) else details):
+                        yield monitor
+                        continue
+                    # Start fetching details as soon as the page arrives.
+                    future = executor.submit(get_monitor, account, monitor.id,
+                                             stoplight=stoplight)
+                    pending[future] = monitor
+
+                for future in [future for future in pending if future.done()]:
+                    yield _merge_details(pending.pop(future), future)
+
+            for future in as_completed(list(pending)):
+                yield _merge_details(pending.pop(future), future)
+        finally:
+            # When the consumer stops early, e.g. its output was closed, don't
+            # make leaving the executors wait for requests nobody will use.
+            pages.close()
+            _cancel(pending)
+
+
+def _merge_details(monitor, future):
+    try:
+        monitor.update(future.result())
+    except Exception as error:
+        monitor.fail(error)
+    return monitor
 
-    for monitor in monitors:
-        # Fetch monitor stoplight
-        url = urls.MONITOR_STOPLIGHT.format(account=account, monitor=monitor['id'])
-        response = session.get(url)
-        response.raise_for_status()
-        monitor.update(response.json())
 
-        # Fetch monitor locations.
-        monitor.update(get_monitor(account, monitor['id']))
+def get_monitors(account, concurrency=DEFAULT_CONCURRENCY, stoplight=True,
+                 page_size=DEFAULT_PAGE_SIZE, details=True, raw=False):
+    monitors = iter_monitors(account, concurrency, stoplight, page_size, details, raw)
 
     # sort data by name
-    monitors = sorted(monitors, key=lambda x: x['name'])
+    monitors = sorted(monitors, key=lambda x: x.name)
 
     return monitors
 
 
 def delete_monitor(account, monitor):
-    url = urls.MONITOR_JSON.format(account=account, monitor=monitor)
-    response = session.get(url)
-    response.raise_for_status()
+    # Deleting from the web console happens on the monitor page.
     headers = {
-        'Referer': response.url,
+        'Referer': urls.MONITOR.format(account=account, monitor=monitor),
     }
 
     url = urls.MONITOR_JSON.format(account=account, monitor=monitor)
     response = session.delete(url, headers=headers)
+    _invalidate_monitor(account, monitor)
     response.raise_for_status()
 
 
@@ -108,12 +360,14 @@ def get_locations(account):
     return response.json()
 
 
-def get_monitor(account, monitor):
+def get_monitor(account, monitor, stoplight=True):
     url = urls.MONITOR_JSON.format(account=account, monitor=monitor)
     response = session.get(url)
     response.raise_for_status()
 
     data = response.json()
+    if not stoplight:
+        return data
 
     # get stoplight status
     url = urls.MONITOR_STOPLIGHT.format(account=account, monitor=monitor)
@@ -124,8 +378,19 @@ def get_monitor(account, monitor):
     return data
 
 
-def update_monitor(account, monitor, *args, **kwargs):
-    data = get_monitor(account, monitor)
+def _unmodified_since(modified_at):
+    """Convert a monitor's modifiedAt into an HTTP date for If-Unmodified-Since."""
+    for date_format in ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z'):
+        try:
+            modified = datetime.strptime(modified_at, date_format)
+        except (TypeError, ValueError):
+            continue
+        return format_datetime(modified.astimezone(timezone.utc), usegmt=True)
+    return None
+
+
+def _apply_update(data, monitor, kwargs):
+    data = copy.deepcopy(data)
     data['id'] = monitor
     data.pop('createdAt', None)
     data.pop('modifiedAt', None)
@@ -152,7 +417,7 @@ def update_monitor(account, monitor, *args, **kwargs):
         values = kwargs.get('remove_{}'.format(prop))
         if values:
             if isinstance(values, str):
-                prop = [values]
+                values = [values]
             data[prop] = list(set(data[prop]) - set(values))
 
     _construct_metadata(
@@ -162,13 +427,38 @@ def update_monitor(account, monitor, *args, **kwargs):
         redirect_is_failure=kwargs.get('redirect_is_failure'),
         metadata=data['metadata'])
 
-    headers = {
-        'Referer': urls.MONITOR.format(account=account, monitor=monitor),
-        'Content-Type': 'application/json;charset=utf-8',
-    }
+    return data
+
 
+def update_monitor(account, monitor, *args, **kwargs):
+    # Callers which already have the monitor document, e.g. from a listing,
+    # can pass it as `base` to save fetching it again. That document may be
+    # outdated, so its modifiedAt is sent as a precondition and on conflict
+    # the update is retried once on a freshly fetched document. Otherwise the
+    # document is fetched fresh, bypassing the cache, to not undo changes
+    # made since it was cached.
+    base = kwargs.pop('base', None)
     url = urls.MONITOR_JSON.format(account=account, monitor=monitor)
-    response = session.put(url, data=json.dumps(data), headers=headers)
+    if base is None:
+        session.invalidate(url)
+        base = get_monitor(account, monitor, stoplight=False)
+
+    for attempt in range(2):
+        headers = {
+            'Referer': urls.MONITOR.format(account=account, monitor=monitor),
+            'Content-Type': 'application/json;charset=utf-8',
+        }
+        unmodified_since = _unmodified_since(base.get('modifiedAt'))
+        if unmodified_since and not attempt:
+            # The retry works on a document we just fetched.
+            headers['If-Unmodified-Since'] = unmodified_since
+
+        data = _apply_update(base, monitor, kwargs)
+        response = session.put(url, data=json.dumps(data), headers=headers)
+        _invalidate_monitor(account, monitor)
+        if response.status_code not in (409, 412) or attempt:
+            break
+        base = get_monitor(account, monitor, stoplight=False)
 
     try:
         response.raise_for_status()
@@ -216,10 +506,16 @@ def _construct_metadata(validation_string=None, bypass_head_request=None,
     return metadata
 
 
+def new_monitor_referer(account):
+    response = session.get(urls.NEW_MONITOR.format(account=account))
+    response.raise_for_status()
+    return response.url
+
+
 def create_monitor(account, name, uri, frequency, locations, emails=[],
                    validation_string='', bypass_head_request=False,
                    verify_ssl=False, redirect_is_failure=False,
-                   slaThreshold=7):
+                   slaThreshold=7, status='ENABLED', referer=None):
     if isinstance(locations, str):
         locations = [locations]
 
@@ -229,10 +525,11 @@ def create_monitor(account, name, uri, frequency, locations, emails=[],
     if validation_string and not bypass_head_request:
         raise Exception('Response validation requires to bypass HEAD request.')
 
-    response = session.get(urls.NEW_MONITOR.format(account=account))
-    response.raise_for_status()
+    # When creating many monitors fetch the referer once and pass it along.
+    if referer is None:
+        referer = new_monitor_referer(account)
     headers = {
-        'Referer': response.url,
+        'Referer': referer,
         'Content-Type': 'application/json;charset=utf-8',
     }
 
@@ -244,7 +541,7 @@ def create_monitor(account, name, uri, frequency, locations, emails=[],
         'type': 'SIMPLE',
         'frequency': frequency,
         'uri': uri,
-        'status': 'ENABLED',
+        'status': status,
         'slaThreshold': slaThreshold,
         'locations': locations,
         'conditions': [],
@@ -268,7 +565,14 @@ def create_monitor(account, name, uri, frequency, locations, emails=[],
     return (0, url, response.json())
 
 
-def get_accounts():
+def get_accounts(refresh=False):
+    if account_cache and not refresh and os.path.exists(account_cache):
+        with open(account_cache) as cache_file:
+            try:
+                return json.load(cache_file)
+            except ValueError:
+                pass
+
     response = session.get(urls.SYNTHETICS)
     response.raise_for_status()
 
@@ -277,46 +581,84 @@ def get_accounts():
     response = session.get(urls.ACCOUNT_INFO.format(account=accountId))
     response.raise_for_status()
 
-    return response.json().get('accountList')
+    accounts = response.json().get('accountList')
+    if account_cache and accounts:
+        with open(account_cache, 'w') as cache_file:
+            json.dump(accounts, cache_file)
+        os.chmod(account_cache, 0o600)
+    return accounts
+
+
+def _monitor_state(monitor):
+    return OrderedDict([
+        ('id', monitor.id),
+        ('name', monitor.name),
+        ('status', monitor.status),
+        ('uri', monitor.uri),
+        ('slaThreshold', monitor.slaThreshold),
+        ('emails', monitor.emails or ''),
+        ('locations', monitor.locations or ''),
+        ('frequency', monitor.frequency),
+        ('verify_ssl', monitor.verify_ssl),
+        ('validation_string', monitor.validation_string),
+        ('bypass_head_request', monitor.bypass_head_request),
+        ('redirect_is_failure', monitor.redirect_is_failure),
+    ])
+
+
+def get_state(account, concurrency=DEFAULT_CONCURRENCY, errors=None,
+              page_size=DEFAULT_PAGE_SIZE):
+    # The state never uses the stoplight, skip fetching it.
+    monitors = get_monitors(account, concurrency, stoplight=False, page_size=page_size)
+    return _project_state(monitors, errors)
+
+
+def iter_state(account, concurrency=DEFAULT_CONCURRENCY, errors=None,
+               page_size=DEFAULT_PAGE_SIZE, snapshot=None):
+    """Yield the state of each monitor, in no particular order, as soon as it's fetched.
+
+    `snapshot` maps monitor ids to their modifiedAt and state, as saved by a
+    previous run. When given, only monitors the listing shows as added or
+    modified since are fetched, and the snapshot is updated in place.
+    """
+    listed = {}
+    unchanged = set()
+
+    def modified(monitor):
+        listed[monitor.id] = monitor.modifiedAt
+        known = snapshot.get(monitor.id)
+        if known and monitor.modifiedAt and known['modifiedAt'] == monitor.modifiedAt:
+            unchanged.add(monitor.id)
+            return False
+        return True
+
+    monitors = iter_monitors(account, concurrency, stoplight=False, page_size=page_size,
+                             details=True if snapshot is None else modified)
+    for monitor in monitors:
+        if monitor.id in unchanged:
+            yield snapshot[monitor.id]['state']
+            continue
+        for monitor_state in _project_state([monitor], errors):
+            if snapshot is not None:
+                # The modifiedAt of the listing is what the next run compares.
+                snapshot[monitor.id] = {'modifiedAt': listed[monitor.id], 'state': monitor_state}
+            yield monitor_state
+
+    if snapshot is not None:
+        for monitor_id in set(snapshot) - set(listed):
+            del snapshot[monitor_id]
 
 
-def get_state(account):
+def _project_state(monitors, errors=None):
     data = []
-    monitors = get_monitors(account)
-
     for monitor in monitors:
-        monitor_details = get_monitor(account, monitor['id'])
-
-        monitor_data = OrderedDict([
-            ('id', monitor['id']),
-            ('name', monitor_details['name']),
-            ('status', monitor_details['status']),
-            ('uri', monitor_details['uri']),
-            ('slaThreshold', monitor_details['slaThreshold']),
-            ('emails', monitor_details['emails'] or ''),
-            ('locations', monitor_details['locations'] or ''),
-            ('frequency', monitor_details['frequency']),
-            ('verify_ssl', False),
-            ('validation_string', False),
-            ('bypass_head_request', False),
-            ('redirect_is_failure', False),
-        ])
-
-        if monitor_details['metadata']:
-            m = monitor_details['metadata']
-
-            if m.get('nr.synthetics.metadata.job.options.simple.bypass.head') == 'true':
-                monitor_data['bypass_head_request'] = True
-
-            response_validation = m.get(
-                'nr.synthetics.metadata.job.options.response-validation', False)
-            monitor_data['validation_string'] = response_validation
-
-            if m.get('nr.synthetics.monitor.tls-validation'):
-                monitor_data['verify_ssl'] = True
-
-            if m.get('nr.synthetics.metadata.job.options.simple.redirect.is.failure'):
-                monitor_data['redirect_is_failure'] = True
-        data.append(monitor_data)
+        if monitor.error is not None:
+            # Monitors we failed to fetch are left out of the state, the
+            # caller decides how to report them.
+            if errors is not None:
+                errors.append(monitor)
+            continue
+
+        data.append(_monitor_state(monitor))
 
     return data
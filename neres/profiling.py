@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import pstats
+import sys
+import threading
+import time
+
+CLOCKS = {
+    # CPU time of the thread being profiled, not of the whole process. Python
+    # 3.6 lacks thread_time, there it's the CPU time of all threads.
+    'cpu': getattr(time, 'thread_time', time.process_time),
+    'wall': time.perf_counter,
+}
+
+# Up to Python 3.11 cProfile only sees the thread that enabled it. Later
+# versions build it on sys.monitoring, which sees all threads but allows a
+# single active profiler.
+PER_THREAD = sys.version_info < (3, 12)
+
+# Functions where threads wait for NewRelic, as (file, function) name fragments.
+NETWORK_FUNCTIONS = [
+    ('socket', 'recv'), ('socket', 'send'), ('socket', 'connect'), ('socket', 'getaddrinfo'),
+    ('ssl', 'read'), ('ssl', 'write'), ('ssl', 'do_handshake'), ('select', 'poll'),
+    ('select', 'select'),
+]
+# Functions where threads wait for each other or for a retry.
+WAIT_FUNCTIONS = [
+    ('lock', 'acquire'), ('time', 'sleep'), ('threading', 'wait'), ('queue', 'get'),
+]
+
+
+def _category(function):
+    filename, _, name = function
+    if filename == '~':
+        # Built-in, the name looks like <method 'recv_into' of '_socket.socket' objects>.
+        filename = name
+    for fragments, category in ((NETWORK_FUNCTIONS, 'network'), (WAIT_FUNCTIONS, 'waiting')):
+        for module, function_name in fragments:
+            if module in filename and function_name in name:
+                return category
+    return 'python'
+
+
+class Profiler(object):
+    """Profile all threads of the process with cProfile.
+
+    neres does most of its work on thread pools. Where cProfile only sees
+    the thread that enabled it, every thread started while profiling gets a
+    profiler of its own and their stats are merged at the end. `clock` is
+    `cpu` to measure time spent running Python or `wall` to include time
+    spent waiting.
+    """
+    def __init__(self, clock='wall'):
+        self.timer = CLOCKS[clock]
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _new_profile(self):
+        profile = cProfile.Profile(self.timer)
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def _thread_started(self, frame, event, arg):
+        # Called on the first event of new threads, replaces itself.
+        self._new_profile()
+
+    def start(self):
+        if PER_THREAD:
+            threading.setprofile(self._thread_started)
+        self._new_profile()
+
+    def stop(self):
+        if PER_THREAD:
+            threading.setprofile(None)
+        for profile in self.profiles:
+            profile.disable()
+
+    def stats(self):
+        return pstats.Stats(*self.profiles)
+
+    def dump(self, path):
+        self.stats().dump_stats(path)
+
+    def report(self, output, limit=10):
+        """Write the functions taking most time, per category, to `output`."""
+        stats = self.stats()
+        categories = {'network': [], 'waiting': [], 'python': []}
+        for function, (_, calls, tottime, cumtime, _) in stats.stats.items():
+            categories[_category(function)].append((tottime, calls, function))
+
+        titles = [
+            ('network', 'Waiting on the network'),
+            ('waiting', 'Waiting on locks and sleeping'),
+            ('python', 'Running Python'),
+        ]
+        for category, title in titles:
+            functions = sorted(categories[category], reverse=True)
+            output.write('{}: {:.3f}s over all threads\n'.format(
+                title, sum(tottime for tottime, _, _ in functions)))
+            for tottime, calls, function in functions[:limit]:
+                output.write('  {:>9.3f}s {:>8} calls  {}\n'.format(
+                    tottime, calls, pstats.func_std_string(function)))
@@ -1,10 +1,351 @@
+import random
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+
 import requests
+from requests.adapters import HTTPAdapter
+from requests.compat import urlparse
+from urllib3.connection import HTTPConnection
+
+import neres.urls as urls
+
+
+DEFAULT_POOL_SIZE = 10
+
+
+class LoginRequired(requests.exceptions.HTTPError):
+    pass
+
+
+class RetryPolicy(object):
+    """When and how long to wait before retrying a failed request.
+
+    Failed requests are retried up to `retries` times with jittered
+    exponential backoff, or after the time the server asks for in
+    Retry-After. GET, PUT and DELETE are retried on connection errors and on
+    any of `statuses`. POST is only retried when the server can't have acted
+    on it: connection timeouts and 429 or 503 responses. `budget` caps the
+    number of retries over all requests of a command.
+    """
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+    SAFE_POST_STATUSES = (429, 503)
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30, budget=100,
+                 statuses=(429, 500, 502, 503, 504)):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.statuses = statuses
+
+    def should_retry(self, method, attempt, response=None, error=None):
+        if attempt >= self.retries:
+            return False
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        if error is not None:
+            return idempotent or isinstance(error, requests.exceptions.ConnectTimeout)
+        if response.status_code not in self.statuses:
+            return False
+        return idempotent or response.status_code in self.SAFE_POST_STATUSES
+
+    def delay(self, attempt, response=None):
+        retry_after = response is not None and response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+            try:
+                date = parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                pass
+            else:
+                return min(max(date.timestamp() - time.time(), 0), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class AdaptiveLimiter(object):
+    """Limit the number of requests in flight, adapting the limit AIMD style.
+
+    The limit grows by one after `limit` consecutive healthy responses and is
+    halved when the server throttles us (429 or 503), a request fails to
+    connect or the latency goes over `latency_factor` times the usual
+    latency of the endpoint, never leaving the [floor, ceiling] range.
+    """
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, floor=1, ceiling=8, latency_factor=2.0):
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        self.latency_factor = latency_factor
+        self.limit = max(floor, self.ceiling // 2)
+        self.lowest = self.highest = self.limit
+        self.in_flight = 0
+        self._baselines = {}
+        self._healthy = 0
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+        return time.time()
+
+    def release(self, started, endpoint=None, status=None, error=False):
+        latency = time.time() - started
+        with self._condition:
+            self.in_flight -= 1
+            throttled = error or status in self.THROTTLE_STATUSES
+            slow = False
+            if not throttled:
+                # Compare recent latency against the long term latency of the
+                # endpoint, so a single slow response doesn't count as a spike.
+                recent, usual = self._baselines.get(endpoint, (latency, latency))
+                recent = 0.7 * recent + 0.3 * latency
+                usual = 0.95 * usual + 0.05 * latency
+                self._baselines[endpoint] = (recent, usual)
+                slow = recent > usual * self.latency_factor
+
+            if throttled or slow:
+                # React once per congestion event, not once per request that
+                # was already in flight when it started.
+                if started > self._last_decrease:
+                    self.limit = max(self.floor, self.limit // 2)
+                    self.lowest = min(self.lowest, self.limit)
+                    self._last_decrease = time.time()
+                self._healthy = 0
+            else:
+                self._healthy += 1
+                if self._healthy >= self.limit and self.limit < self.ceiling:
+                    self.limit += 1
+                    self.highest = max(self.highest, self.limit)
+                    self._healthy = 0
+            self._condition.notify_all()
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter with TCP keep-alive enabled on its connections."""
+    KEEPALIVE_OPTIONS = [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ] + [
+        (socket.IPPROTO_TCP, getattr(socket, name), value)
+        for name, value in [('TCP_KEEPIDLE', 60), ('TCP_KEEPINTVL', 15), ('TCP_KEEPCNT', 4)]
+        if hasattr(socket, name)
+    ]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + self.KEEPALIVE_OPTIONS
+        super(KeepAliveAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def connection_stats(self):
+        """Return the number of connections opened and requests sent through them."""
+        connections = requests_sent = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+        return connections, requests_sent
 
 
 class Session(requests.Session):
+    def __init__(self):
+        super(Session, self).__init__()
+        # Identical GET requests in flight at the same time while running a
+        # command are collapsed into one. Responses aren't kept once the
+        # request is over, they'd cost memory and commands don't repeat
+        # requests. Only enabled between start_command and end_command.
+        self.memoize = False
+        self.requests_saved = 0
+        # Optional neres.cache.Cache for responses that survive between commands.
+        self.cache = None
+        self.cache_hits = 0
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+        # Called when a request bounces to the login page. It should return
+        # True if the session is valid again, so the request can be retried.
+        self.reauthenticate = None
+        self._auth_lock = threading.Lock()
+        self._auth_generation = 0
+        self.retry_policy = RetryPolicy()
+        self.retries = 0
+        self._retries_lock = threading.Lock()
+        # Optional AdaptiveLimiter bounding the requests in flight.
+        self.limiter = None
+        # Called with a dict describing every request sent, after retries:
+        # method, url, endpoint, status, latency, queued, backoff, bytes,
+        # retries and error.
+        self.observers = []
+        self.configure_pool(DEFAULT_POOL_SIZE)
+
+    def configure_pool(self, size):
+        """Mount adapters for the NewRelic hosts with room for `size` connections each.
+
+        When all connections are busy requests wait for one instead of
+        opening connections that would be thrown away afterwards.
+        """
+        for adapter in getattr(self, 'pool_adapters', []):
+            adapter.close()
+        self.pool_adapters = []
+        for url in (urls.SYNTHETICS, urls.LOGIN):
+            parsed = urlparse(url)
+            adapter = KeepAliveAdapter(pool_connections=1, pool_maxsize=size, pool_block=True)
+            self.mount('{}://{}'.format(parsed.scheme, parsed.netloc), adapter)
+            self.pool_adapters.append(adapter)
+
+    def reset(self):
+        """Start a new command: forget memoized responses and reset the counters."""
+        self.reset_memo()
+        self.cache_hits = 0
+        self.retries = 0
+
+    def start_command(self):
+        """Reset the session for a new command and memoize GET requests until it ends."""
+        self.reset()
+        self.memoize = True
+
+    def end_command(self):
+        """Stop memoizing and drop memoized responses, keeping the counters."""
+        self.memoize = False
+        self.forget()
+
+    def stats(self):
+        stats = {
+            'requests_saved': self.requests_saved,
+            'cache_hits': self.cache_hits,
+            'retries': self.retries,
+        }
+        connections = requests_sent = 0
+        for adapter in self.pool_adapters:
+            adapter_connections, adapter_requests = adapter.connection_stats()
+            connections += adapter_connections
+            requests_sent += adapter_requests
+        stats['connections_new'] = connections
+        stats['connections_reused'] = requests_sent - connections
+        if self.limiter:
+            stats['concurrency_limit'] = self.limiter.limit
+            stats['concurrency_lowest'] = self.limiter.lowest
+            stats['concurrency_highest'] = self.limiter.highest
+        return stats
+
+    def reset_memo(self):
+        with self._memo_lock:
+            self._memo = {}
+            self.requests_saved = 0
+
+    def forget(self, url=None):
+        """Drop memoized responses for `url`, or all of them if no url is given."""
+        with self._memo_lock:
+            if url is None:
+                self._memo = {}
+                return
+            for key in [key for key in self._memo if key[0] == url]:
+                del self._memo[key]
+
+    def _needs_login(self, response):
+        login_host = urlparse(urls.LOGIN).netloc
+        # After redirects response.request is the last request, not ours.
+        request = response.history[0].request if response.history else response.request
+        if urlparse(request.url).netloc == login_host:
+            # Talking to the login server itself, e.g. when probing the session.
+            return False
+        if response.status_code == 401:
+            return True
+        return bool(response.history) and urlparse(response.url).netloc == login_host
+
+    def _take_retry(self):
+        with self._retries_lock:
+            if self.retries >= self.retry_policy.budget:
+                return False
+            self.retries += 1
+            return True
+
+    def _send(self, method, url, *args, **kwargs):
+        policy = self.retry_policy
+        endpoint = urls.endpoint(url)
+        timing = {'time': time.time(), 'queued': 0, 'backoff': 0}
+        attempt = 0
+        while True:
+            limiter = self.limiter
+            waiting = time.time()
+            started = limiter.acquire() if limiter else waiting
+            timing['queued'] += started - waiting
+            try:
+                response = super(Session, self).request(method, url, *args, **kwargs)
+            except Exception as error:
+                if limiter:
+                    limiter.release(started, endpoint, error=True)
+                if not (isinstance(error, (requests.exceptions.ConnectionError,
+                                           requests.exceptions.Timeout)) and
+                        policy.should_retry(method, attempt, error=error) and
+                        self._take_retry()):
+                    self._observe(method, url, endpoint, started, timing, attempt, error=error)
+                    raise
+                delay = policy.delay(attempt)
+            else:
+                if limiter:
+                    limiter.release(started, endpoint, response.status_code)
+                if not (policy.should_retry(method, attempt, response=response) and
+                        self._take_retry()):
+                    self._observe(method, url, endpoint, started, timing, attempt,
+                                  response=response)
+                    return response
+                response.close()
+                delay = policy.delay(attempt, response)
+            time.sleep(delay)
+            timing['backoff'] += delay
+            attempt += 1
+
+    def _observe(self, method, url, endpoint, started, timing, retries, response=None,
+                 error=None):
+        # The latency is that of the last attempt, time spent waiting for the
+        # limiter and backing off before retries is reported separately.
+        if not self.observers:
+            return
+        record = {
+            'time': timing['time'],
+            'method': method.upper(),
+            'url': url,
+            'endpoint': endpoint or urlparse(url).path,
+            'status': response.status_code if response is not None else None,
+            'latency': time.time() - started,
+            'queued': timing['queued'],
+            'backoff': timing['backoff'],
+            'bytes': len(response.content) if response is not None else 0,
+            'retries': retries,
+            'error': str(error) if error is not None else None,
+        }
+        for observer in self.observers:
+            observer(record)
+
+    def request(self, method, url, *args, **kwargs):
+        generation = self._auth_generation
+        response = self._send(method, url, *args, **kwargs)
+        if not self._needs_login(response):
+            return response
+
+        with self._auth_lock:
+            # Another thread may have logged in again while we were waiting.
+            if generation == self._auth_generation:
+                if not (self.reauthenticate and self.reauthenticate()):
+                    raise LoginRequired('Login required', response=response)
+                self._auth_generation += 1
+
+        response = self._send(method, url, *args, **kwargs)
+        if self._needs_login(response):
+            raise LoginRequired('Login required', response=response)
+        return response
+
     def _set_xsrf_headers(self, kwargs):
         try:
-            xsrf_token = self.cookies._cookies['synthetics.newrelic.com']['/']['XSRF-TOKEN'].value
+            domain = urlparse(urls.SYNTHETICS).hostname
+            xsrf_token = self.cookies._cookies[domain]['/']['XSRF-TOKEN'].value
         except KeyError:
             return kwargs
         else:
@@ -18,23 +359,87 @@ class Session(requests.Session):
                 kwargs['headers'] = xsrf_header
         return kwargs
 
-    def get(self, *args, **kwargs):
-        response = super(Session, self).get(*args, **kwargs)
+    def _get(self, url, **kwargs):
+        cache = self.cache
+        if cache is None or kwargs:
+            return super(Session, self).get(url, **kwargs)
+
+        entry = cache.get(url)
+        if entry and entry['fresh']:
+            cache.hit(url)
+            self.cache_hits += 1
+            return cache.response(entry)
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        response = super(Session, self).get(url, headers=headers)
+        if response.status_code == 304 and entry:
+            cache.touch(url, entry)
+            self.cache_hits += 1
+            return cache.response(entry)
+
+        if response.ok:
+            cache.put(url, response)
+        return response
+
+    def invalidate(self, url):
+        """Forget everything memoized or cached about `url`."""
+        self.forget(url)
+        if self.cache is not None:
+            self.cache.invalidate(url)
+
+    def get(self, url, **kwargs):
+        if not self.memoize:
+            return self._get(url, **kwargs)
+
+        key = (url, tuple(sorted((name, repr(value)) for name, value in kwargs.items())))
+        with self._memo_lock:
+            future = self._memo.get(key)
+            if future is None:
+                future = self._memo[key] = Future()
+                owner = True
+            else:
+                self.requests_saved += 1
+                owner = False
+
+        if not owner:
+            return future.result()
+
+        try:
+            response = self._get(url, **kwargs)
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(response)
+        finally:
+            # Requests already waiting get the response, later ones ask again.
+            self._forget_key(key)
         return response
 
+    def _forget_key(self, key):
+        with self._memo_lock:
+            self._memo.pop(key, None)
+
     def post(self, *args, **kwargs):
         if kwargs.pop('add_xsrf_token', True):
             kwargs = self._set_xsrf_headers(kwargs)
         response = super(Session, self).post(*args, **kwargs)
         return response
 
-    def put(self, *args, **kwargs):
+    def put(self, url, *args, **kwargs):
         if kwargs.pop('add_xsrf_token', True):
             kwargs = self._set_xsrf_headers(kwargs)
-        response = super(Session, self).put(*args, **kwargs)
+        self.invalidate(url)
+        response = super(Session, self).put(url, *args, **kwargs)
         return response
 
-    def delete(self, *args, **kwargs):
+    def delete(self, url, *args, **kwargs):
         kwargs = self._set_xsrf_headers(kwargs)
-        response = super(Session, self).delete(*args, **kwargs)
+        self.invalidate(url)
+        response = super(Session, self).delete(url, *args, **kwargs)
         return response
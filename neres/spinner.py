@@ -4,7 +4,6 @@ from __future__ import print_function
 
 import itertools
 import sys
-import time
 import threading
 
 
@@ -30,7 +29,8 @@ class Spinner(object):
         while not self.stop_running.is_set():
             sys.stderr.write(next(self.spinner_cycle))
             sys.stderr.flush()
-            time.sleep(0.35)
+            # Wait on the event instead of sleeping so stop() returns at once.
+            self.stop_running.wait(0.35)
             sys.stderr.write('\b')
 
     def __enter__(self):
@@ -40,3 +40,28 @@ class Spinner(object):
 
     def __exit__(self, *args):
         self.stop()
+
+
+class Progress(object):
+    """Report progress of parallel work as `message done/total` on a single line."""
+    def __init__(self, message, total):
+        self.message = message
+        self.total = total
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def _write(self):
+        sys.stderr.write('\r{}{}/{}'.format(self.message, self.done, self.total))
+        sys.stderr.flush()
+
+    def update(self, *args):
+        with self.lock:
+            self.done += 1
+            self._write()
+
+    def __enter__(self):
+        self._write()
+        return self
+
+    def __exit__(self, *args):
+        sys.stderr.write('\n')
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import os
+import textwrap
+from collections import OrderedDict
+
+import yaml
+
+import neres
+import neres.newrelic as newrelic
+
+# libyaml is many times faster than the pure Python implementation.
+try:
+    from yaml import CSafeDumper as _SafeDumper, CSafeLoader as StateLoader
+except ImportError:
+    from yaml import SafeDumper as _SafeDumper, SafeLoader as StateLoader
+
+
+class StateDumper(_SafeDumper):
+    """Safe YAML dumper that keeps the order of OrderedDicts."""
+
+
+StateDumper.add_representer(
+    OrderedDict,
+    lambda dumper, data: dumper.represent_mapping('tag:yaml.org,2002:map', data.items()))
+
+# Fields compared as sets, the order NewRelic returns them in doesn't matter.
+SET_FIELDS = ('emails', 'locations')
+
+
+def _as_set(value):
+    # get-state writes empty lists as ''.
+    return set(value or [])
+
+
+def diff_monitor(here, there):
+    """Return the fields that differ between two monitor states.
+
+    The result maps each changed field to a (there, here) tuple, in the
+    order of the fields in `here`.
+    """
+    changes = OrderedDict()
+    for field, value in here.items():
+        if field == 'id':
+            continue
+        current = there.get(field)
+        if field in SET_FIELDS:
+            if _as_set(value) != _as_set(current):
+                changes[field] = (current, value)
+        elif value != current:
+            changes[field] = (current, value)
+    return changes
+
+
+def reconcile(here_data, there_monitors):
+    """Compare a statefile with the monitors currently in NewRelic.
+
+    `there_monitors` are Monitors as returned by `newrelic.get_monitors`.
+    Returns a list of (monitor, changes) tuples for the monitors that need
+    updating, where `monitor` is the current Monitor, and the list of ids
+    only found in the statefile.
+    """
+    there_index = dict((monitor.id, monitor) for monitor in there_monitors)
+
+    changed = []
+    missing = []
+    for here in here_data:
+        there = there_index.get(here['id'])
+        if there is None:
+            missing.append(here['id'])
+            continue
+
+        changes = diff_monitor(here, newrelic._monitor_state(there))
+        if changes:
+            changed.append((there, changes))
+    return changed, missing
+
+
+def update_arguments(changes):
+    """Turn the result of `diff_monitor` into keyword arguments for `update_monitor`."""
+    kwargs = {}
+    for field, (current, value) in changes.items():
+        if field in SET_FIELDS:
+            kwargs['add_{}'.format(field)] = list(_as_set(value) - _as_set(current))
+            kwargs['remove_{}'.format(field)] = list(_as_set(current) - _as_set(value))
+        else:
+            kwargs[field] = value
+    return kwargs
+
+
+def format_changes(changes):
+    lines = []
+    for field, (current, value) in changes.items():
+        if field in SET_FIELDS:
+            added = sorted(_as_set(value) - _as_set(current))
+            removed = sorted(_as_set(current) - _as_set(value))
+            value = ', '.join(['+' + item for item in added] + ['-' + item for item in removed])
+            lines.append('{}: {}'.format(field, value))
+        else:
+            lines.append('{}: {!r} -> {!r}'.format(field, current, value))
+    return lines
+
+
+FREQUENCIES = (1, 5, 10, 15, 30, 60, 360, 720, 1440)
+STATUSES = ('ENABLED', 'DISABLED', 'MUTED')
+BOOLEAN_FIELDS = ('verify_ssl', 'bypass_head_request', 'redirect_is_failure')
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ('true', 'yes', '1'):
+        return True
+    if str(value).strip().lower() in ('false', 'no', '0', ''):
+        return False
+    raise ValueError('expected true or false, got {!r}'.format(value))
+
+
+def _list(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        # CSV files separate multiple values with semicolons.
+        return [item.strip() for item in value.split(';') if item.strip()]
+    return list(value)
+
+
+def validate_spec(spec):
+    """Validate a monitor spec, in the vocabulary of get-state, for `create_monitor`.
+
+    Returns the keyword arguments for `newrelic.create_monitor` or raises
+    ValueError listing everything wrong with the spec.
+    """
+    errors = []
+    # New monitors get ids of their own, ignore those of a get-state file.
+    unknown = set(spec) - {'id', 'name', 'uri', 'status', 'slaThreshold', 'emails', 'locations',
+                           'frequency', 'validation_string'} - set(BOOLEAN_FIELDS)
+    if unknown:
+        errors.append('unknown fields {}'.format(', '.join(sorted(unknown))))
+
+    kwargs = {
+        'name': str(spec.get('name') or '').strip(),
+        'uri': str(spec.get('uri') or '').strip(),
+        'status': str(spec.get('status') or 'ENABLED').upper(),
+        'emails': _list(spec.get('emails')),
+        'locations': _list(spec.get('locations')) or ['AWS_US_WEST_1'],
+    }
+    if not kwargs['name']:
+        errors.append('name is required')
+    if not kwargs['uri'].startswith(('http://', 'https://')):
+        errors.append('uri must be an http or https URL')
+    if kwargs['status'] not in STATUSES:
+        errors.append('status must be one of {}'.format(', '.join(STATUSES)))
+
+    try:
+        kwargs['frequency'] = int(spec.get('frequency') or 10)
+        if kwargs['frequency'] not in FREQUENCIES:
+            raise ValueError()
+    except ValueError:
+        errors.append('frequency must be one of {}'.format(
+            ', '.join(str(frequency) for frequency in FREQUENCIES)))
+
+    try:
+        kwargs['slaThreshold'] = int(spec.get('slaThreshold') or 7)
+    except ValueError:
+        errors.append('slaThreshold must be a number')
+
+    for field in BOOLEAN_FIELDS:
+        try:
+            kwargs[field] = _boolean(spec.get(field, False))
+        except ValueError as error:
+            errors.append('{}: {}'.format(field, error))
+
+    validation_string = spec.get('validation_string')
+    kwargs['validation_string'] = validation_string if isinstance(validation_string, str) else ''
+    if kwargs['validation_string']:
+        # Validating the response requires a full GET.
+        kwargs['bypass_head_request'] = True
+
+    if errors:
+        raise ValueError('; '.join(errors))
+    return kwargs
+
+
+def load_specs(specfile):
+    """Load monitor specs from a YAML list or a CSV file with a header row."""
+    if specfile.name.lower().endswith('.csv'):
+        return [dict(row) for row in csv.DictReader(specfile)]
+
+    specs = yaml.load(specfile, Loader=StateLoader)
+    if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+        raise ValueError('Expected a list of monitors')
+    return specs
+
+
+# Bump when the state of a monitor changes, so that old snapshots are ignored.
+SNAPSHOT_VERSION = 1
+
+
+def load_snapshot(path):
+    """Load the snapshot of `newrelic.iter_state` saved in `path`, or an empty one."""
+    try:
+        with open(path) as snapshot_file:
+            data = json.load(snapshot_file, object_pairs_hook=OrderedDict)
+    except (IOError, ValueError):
+        return {}
+    if (not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION or
+            data.get('neres') != neres.__version__):
+        return {}
+    return dict(data.get('monitors') or {})
+
+
+def save_snapshot(path, snapshot):
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory, 0o700)
+    data = {'version': SNAPSHOT_VERSION, 'neres': neres.__version__, 'monitors': snapshot}
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as snapshot_file:
+        json.dump(data, snapshot_file)
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+
+
+def dump_yaml(data):
+    return yaml.dump(data, Dumper=StateDumper, allow_unicode=True, default_flow_style=False)
+
+
+class StateWriter(object):
+    """Write a statefile out of monitor states arriving in any order.
+
+    Each state is serialized as soon as it's added, while the rest of the
+    monitors are still being fetched, and `write` puts them in name order.
+    The output is the same as serializing the sorted list in one go.
+    """
+    def __init__(self, output_format='yaml'):
+        self.output_format = output_format
+        self._documents = []
+
+    def add(self, monitor_state):
+        if self.output_format == 'json':
+            document = textwrap.indent(json.dumps(monitor_state, indent=2), '  ')
+        else:
+            # A one item list, so that documents concatenate into a list.
+            document = dump_yaml([monitor_state])
+        self._documents.append(((monitor_state['name'], monitor_state['id']), document))
+
+    def by_id(self):
+        """Return the serialized state of each monitor by monitor id."""
+        return dict((monitor_id, document) for (_, monitor_id), document in self._documents)
+
+    def write(self, output):
+        documents = [document for _, document in sorted(self._documents, key=lambda x: x[0])]
+        if not documents:
+            output.write('[]\n')
+        elif self.output_format == 'json':
+            output.write('[\n' + ',\n'.join(documents) + '\n]\n')
+        else:
+            output.write(''.join(documents))
+
+
+def load_state(statefile):
+    """Load a statefile written by get-state in YAML or JSON."""
+    content = statefile.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    if content.lstrip().startswith(('[', '{')):
+        return json.loads(content, object_pairs_hook=OrderedDict)
+    return yaml.load(content, Loader=StateLoader)
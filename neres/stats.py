@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import threading
+from collections import OrderedDict
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return 0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class RequestStats(object):
+    """Session observer collecting request latencies and sizes per endpoint."""
+    def __init__(self):
+        self.endpoints = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            endpoint = self.endpoints.setdefault(record['endpoint'], {
+                'latencies': [],
+                'bytes': 0,
+                'retries': 0,
+                'errors': 0,
+            })
+            endpoint['latencies'].append(record['latency'])
+            endpoint['bytes'] += record['bytes']
+            endpoint['retries'] += record['retries']
+            if record['error'] or record['status'] >= 400:
+                endpoint['errors'] += 1
+
+    def summary(self):
+        """Return a list of (endpoint, count, p50, p95, max, bytes, retries, errors)."""
+        rows = []
+        with self._lock:
+            for name, endpoint in self.endpoints.items():
+                latencies = sorted(endpoint['latencies'])
+                rows.append((name, len(latencies), percentile(latencies, 0.5),
+                             percentile(latencies, 0.95), latencies[-1], endpoint['bytes'],
+                             endpoint['retries'], endpoint['errors']))
+        return rows
+
+
+class Tracer(object):
+    """Session observer writing every request as a JSON line to `output`."""
+    def __init__(self, output):
+        self.output = output
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record)
+        with self._lock:
+            self.output.write(line + '\n')
@@ -1,13 +1,47 @@
-SYNTHETICS = 'https://synthetics.newrelic.com'
-LOGIN = 'https://login.newrelic.com/login'
-MONITORS = 'https://synthetics.newrelic.com/accounts/{account}/monitors.json'
-MONITORS_V2 = ('https://synthetics.newrelic.com/accounts/{account}'
-               '/v2/monitors.json?offset={offset}&limit=15')
-ACCOUNT_INFO = 'https://synthetics.newrelic.com/accounts/{account}/info.json'
-MONITOR_JSON = 'https://synthetics.newrelic.com/accounts/{account}/monitors/{monitor}.json'
-MONITOR = 'https://synthetics.newrelic.com/accounts/{account}/monitors/{monitor}'
-NEW_MONITOR = 'https://synthetics.newrelic.com/accounts/{account}/monitors/new'
-MONITOR_LOCATIONS = 'https://synthetics.newrelic.com/accounts/{account}/locations/list.json'
-IDLE = 'https://login.newrelic.com/idle_timeout'
-MONITOR_STOPLIGHT = ('https://synthetics.newrelic.com/accounts/{account}'
-                     '/monitors/{monitor}/stoplight.json')
+import os
+import re
+
+_SYNTHETICS_BASE = 'https://synthetics.newrelic.com'
+_LOGIN_BASE = 'https://login.newrelic.com'
+
+
+def configure(synthetics=_SYNTHETICS_BASE, login=_LOGIN_BASE):
+    """Point neres to different Synthetics and login servers, e.g. for testing."""
+    global SYNTHETICS, LOGIN, MONITORS, MONITORS_V2, ACCOUNT_INFO, MONITOR_JSON, MONITOR, \
+        NEW_MONITOR, MONITOR_LOCATIONS, IDLE, MONITOR_STOPLIGHT
+
+    SYNTHETICS = synthetics
+    LOGIN = login + '/login'
+    MONITORS = synthetics + '/accounts/{account}/monitors.json'
+    MONITORS_V2 = synthetics + '/accounts/{account}/v2/monitors.json?offset={offset}&limit={limit}'
+    ACCOUNT_INFO = synthetics + '/accounts/{account}/info.json'
+    MONITOR_JSON = synthetics + '/accounts/{account}/monitors/{monitor}.json'
+    MONITOR = synthetics + '/accounts/{account}/monitors/{monitor}'
+    NEW_MONITOR = synthetics + '/accounts/{account}/monitors/new'
+    MONITOR_LOCATIONS = synthetics + '/accounts/{account}/locations/list.json'
+    IDLE = login + '/idle_timeout'
+    MONITOR_STOPLIGHT = synthetics + '/accounts/{account}/monitors/{monitor}/stoplight.json'
+
+
+configure(os.environ.get('NERES_SYNTHETICS_URL', _SYNTHETICS_BASE).rstrip('/'),
+          os.environ.get('NERES_LOGIN_URL', _LOGIN_BASE).rstrip('/'))
+
+
+_patterns = {}
+
+
+def endpoint(url):
+    """Return the name of the URL template `url` was built from, or None."""
+    candidates = [(name, value) for name, value in globals().items()
+                  if name.isupper() and not name.startswith('_') and isinstance(value, str)]
+    # Try the most specific templates first, e.g. MONITOR_JSON before MONITOR.
+    candidates.sort(key=lambda item: len(re.sub(r'{\w+}', '', item[1])), reverse=True)
+    for name, template in candidates:
+        pattern = _patterns.get(template)
+        if pattern is None:
+            parts = re.split(r'{\w+}', template)
+            pattern = '[^/?&]+'.join(re.escape(part) for part in parts)
+            pattern = _patterns[template] = re.compile(pattern + '$')
+        if pattern.match(url):
+            return name
+    return None
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark neres commands against a local fake Synthetics server.
+
+Runs `list-monitors`, `get-state` and `update-from-statefile --apply` as
+separate processes, the way users run them, for each fleet size and reports
+wall time, requests served and peak RSS:
+
+    python -m tests.benchmark --sizes 100,1000 --latency 0.05 --errors 0.01
+"""
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from tests.fakeserver import FakeSynthetics
+
+
+def run(command, env, stdout=subprocess.DEVNULL):
+    """Run a neres command and return (wall time, peak RSS in KB)."""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'neres.cli'] + command, env=env,
+                               stdout=stdout, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    # wait4 reaped the process already, let Popen know.
+    process.returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status) else
+                          -os.WTERMSIG(status))
+    elapsed = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError('neres {} failed:\n{}'.format(' '.join(command),
+                                                         stderr.decode('utf-8', 'replace')))
+    return elapsed, usage.ru_maxrss
+
+
+def change_frequencies(path, every=10):
+    """Change the frequency of every `every`th monitor in a state file."""
+    with open(path) as state_file:
+        lines = state_file.readlines()
+    seen = 0
+    for number, line in enumerate(lines):
+        match = re.match(r'(\s*frequency: )(\d+)$', line)
+        if match:
+            if seen % every == 0:
+                frequency = 1440 if match.group(2) != '1440' else 720
+                lines[number] = '{}{}\n'.format(match.group(1), frequency)
+            seen += 1
+    with open(path, 'w') as state_file:
+        state_file.writelines(lines)
+
+
+def benchmark(size, args):
+    home = tempfile.mkdtemp(prefix='neres-benchmark-')
+    server = FakeSynthetics(monitors=size, latency=args.latency, error_rate=args.errors,
+                            throttle_rate=args.throttle, max_page_size=args.max_page_size)
+    results = []
+    try:
+        server.start()
+        env = dict(os.environ, HOME=home,
+                   NERES_SYNTHETICS_URL=server.synthetics_url,
+                   NERES_LOGIN_URL=server.login_url)
+        common = ['--no-cache', '--concurrency', str(args.concurrency)]
+        run(['--email', 'benchmark@example.com', '--password', 'secret', 'login'], env)
+
+        state = os.path.join(home, 'state.yml')
+        steps = [
+            ('list-monitors', common + ['list-monitors'], None),
+            ('get-state', common + ['get-state'], state),
+            ('update-from-statefile', common + ['update-from-statefile', '--apply', state],
+             None),
+        ]
+        for name, command, output in steps:
+            if name == 'update-from-statefile':
+                change_frequencies(state)
+            server.reset_requests()
+            if output:
+                with open(output, 'w') as output_file:
+                    elapsed, rss = run(command, env, stdout=output_file)
+            else:
+                elapsed, rss = run(command, env)
+            results.append((size, name, elapsed, server.total_requests(), rss))
+    finally:
+        server.stop()
+        shutil.rmtree(home, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help='Comma separated fleet sizes. Default 100,1000,10000.')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds added to every request. Default 0.02.')
+    parser.add_argument('--errors', type=float, default=0,
+                        help='Fraction of requests failing with 502. Default 0.')
+    parser.add_argument('--throttle', type=float, default=0,
+                        help='Fraction of requests throttled with 429. Default 0.')
+    parser.add_argument('--max-page-size', type=int, default=100,
+                        help='Largest listing page the server returns. Default 100.')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='neres --concurrency. Default 8.')
+    args = parser.parse_args(argv)
+
+    print('{:>7}  {:<22} {:>9} {:>9} {:>10}'.format(
+        'Size', 'Command', 'Wall (s)', 'Requests', 'RSS (MB)'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for size, name, elapsed, requests, rss in benchmark(size, args):
+            # ru_maxrss is in kilobytes on Linux.
+            print('{:>7}  {:<22} {:>9.2f} {:>9} {:>10.1f}'.format(
+                size, name, elapsed, requests, rss / 1024.0))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark writing and reading statefiles in YAML and JSON.
+
+    python -m tests.benchmark_state --sizes 1000,10000
+"""
+import argparse
+import io
+import time
+
+import yaml
+
+from neres import newrelic, state
+from neres.monitor import Monitor
+from tests.fakeserver import make_monitor
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def write(output_format, states):
+    writer = state.StateWriter(output_format)
+    for monitor_state in states:
+        writer.add(monitor_state)
+    output = io.StringIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def benchmark(size):
+    states = [newrelic._monitor_state(Monitor(make_monitor(number))) for number in range(size)]
+    expected = sorted(states, key=lambda monitor_state: (monitor_state['name'],
+                                                         monitor_state['id']))
+    results = []
+    for output_format in ('yaml', 'json'):
+        write_time, content = timed(write, output_format, states)
+        read_time, loaded = timed(state.load_state, io.StringIO(content))
+        assert loaded == expected, 'Round trip changed the {} statefile'.format(output_format)
+        results.append((size, output_format, write_time, read_time, len(content)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='Comma separated numbers of monitors. Default 1000,10000.')
+    args = parser.parse_args(argv)
+
+    print('libyaml: {}'.format('yes' if yaml.__with_libyaml__ else 'no'))
+    print('{:>7}  {:<6} {:>9} {:>9} {:>10}'.format('Size', 'Format', 'Write (s)', 'Read (s)',
+                                                   'Size (KB)'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for size, output_format, write_time, read_time, length in benchmark(size):
+            print('{:>7}  {:<6} {:>9.3f} {:>9.3f} {:>10.1f}'.format(
+                size, output_format, write_time, read_time, length / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Fixtures running neres against the fake Synthetics server.
+
+Modules configure the server by overriding `server_options`, the keyword
+arguments of FakeSynthetics, e.g. with a parametrized fixture.
+"""
+import pytest
+from click.testing import CliRunner
+
+from neres import cli, urls
+from tests.fakeserver import ACCOUNT, EMAIL, PASSWORD, FakeSynthetics
+
+
+@pytest.fixture
+def server_options():
+    return {'monitors': 25}
+
+
+@pytest.fixture
+def server(server_options, tmpdir, monkeypatch):
+    """A running FakeSynthetics, logged in to with the cli from an empty HOME."""
+    monkeypatch.setenv('HOME', str(tmpdir))
+    for variable in ('NERES_EMAIL', 'NERES_PASSWORD', 'NERES_ACCOUNT'):
+        monkeypatch.delenv(variable, raising=False)
+
+    server = FakeSynthetics(**server_options).start()
+    urls.configure(server.synthetics_url, server.login_url)
+    result = CliRunner(mix_stderr=False).invoke(cli.cli, ['--email', EMAIL, '--password',
+                                                          PASSWORD, 'login'])
+    assert result.exit_code == 0, result.stderr
+    server.reset_requests()
+
+    yield server
+
+    server.stop()
+    urls.configure()
+
+
+@pytest.fixture
+def neres():
+    """Run the cli in-process on the account of the fake server, return the click Result."""
+    def run(*args, **kwargs):
+        command = ['--account', str(ACCOUNT)] + list(args)
+        return CliRunner(mix_stderr=False).invoke(cli.cli, command, **kwargs)
+    return run
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the NewRelic Synthetics and login servers.
+
+It implements the endpoints in `neres.urls` over a generated fleet of
+monitors, can add latency and inject errors and throttling, and counts the
+requests it serves per endpoint. Point neres to it with
+`neres.urls.configure(server.synthetics_url, server.login_url)` or the
+NERES_SYNTHETICS_URL and NERES_LOGIN_URL environment variables:
+
+    with FakeSynthetics(monitors=1000, latency=0.02) as server:
+        ...
+        print(server.requests)
+"""
+import hashlib
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ACCOUNT = 1
+# Any credentials log in, these are the ones tests use.
+EMAIL = 'user@example.com'
+PASSWORD = 'secret'
+LOCATIONS = ['AWS_US_WEST_1', 'AWS_US_EAST_1', 'AWS_EU_WEST_1', 'AWS_AP_SOUTHEAST_1']
+
+SYNTHETICS_ROUTES = [
+    ('SYNTHETICS', r'/'),
+    ('ACCOUNT_INFO', r'/accounts/(?P<account>\d+)/info\.json'),
+    ('MONITORS_V2', r'/accounts/(?P<account>\d+)/v2/monitors\.json'),
+    ('MONITORS', r'/accounts/(?P<account>\d+)/monitors\.json'),
+    ('NEW_MONITOR', r'/accounts/(?P<account>\d+)/monitors/new'),
+    ('MONITOR_STOPLIGHT',
+     r'/accounts/(?P<account>\d+)/monitors/(?P<monitor>[^/]+)/stoplight\.json'),
+    ('MONITOR_JSON', r'/accounts/(?P<account>\d+)/monitors/(?P<monitor>[^/]+)\.json'),
+    ('MONITOR_LOCATIONS', r'/accounts/(?P<account>\d+)/locations/list\.json'),
+]
+LOGIN_ROUTES = [
+    ('LOGIN', r'/login'),
+    ('IDLE', r'/idle_timeout'),
+]
+
+
+def _timestamp(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+
+
+def make_monitor(number, moment=None):
+    moment = moment or datetime(2020, 1, 1)
+    return {
+        'id': str(uuid.UUID(int=number + 1)),
+        'name': 'monitor-{:05d}'.format(number),
+        'type': 'SIMPLE',
+        'frequency': [5, 10, 15, 60][number % 4],
+        'uri': 'https://example.com/{}'.format(number),
+        'locations': LOCATIONS[:1 + number % len(LOCATIONS)],
+        'status': 'ENABLED',
+        'slaThreshold': 7,
+        'emails': ['alerts-{}@example.com'.format(number % 3)],
+        'metadata': {
+            'nr.synthetics.monitor.tls-validation': number % 2 == 0,
+        },
+        'conditions': [],
+        'createdAt': _timestamp(moment),
+        'modifiedAt': _timestamp(moment),
+    }
+
+
+class FakeSynthetics(object):
+    """Serve a fake Synthetics account with `monitors` monitors.
+
+    `latency` seconds are added to every request, `error_rate` and
+    `throttle_rate` are the probabilities of answering with a 502 or a 429.
+    `max_page_size` caps the listing page size like the real server does,
+    `listing_total` includes the total number of monitors in listing pages.
+    `etags` sends ETags and answers matching If-None-Match with a 304.
+    """
+    def __init__(self, monitors=100, latency=0, error_rate=0, throttle_rate=0,
+                 max_page_size=100, listing_total=False, etags=False, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_page_size = max_page_size
+        self.listing_total = listing_total
+        self.etags = etags
+        self.random = random.Random(seed)
+        self.monitors = {}
+        for number in range(monitors):
+            monitor = make_monitor(number)
+            self.monitors[monitor['id']] = monitor
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self._failures = []
+        self._broken_monitors = {}
+        # Value of the session cookie of logged in users, see expire_sessions.
+        self.session = 'valid'
+        self._expire_after = None
+        self._servers = []
+
+    # Lifecycle
+
+    def start(self):
+        for routes in (SYNTHETICS_ROUTES, LOGIN_ROUTES):
+            server = _ThreadingHTTPServer(('127.0.0.1', 0), _make_handler(self, routes))
+            thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05},
+                                      daemon=True)
+            thread.start()
+            self._servers.append(server)
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def synthetics_url(self):
+        return 'http://127.0.0.1:{}'.format(self._servers[0].server_port)
+
+    @property
+    def login_url(self):
+        return 'http://127.0.0.1:{}'.format(self._servers[1].server_port)
+
+    def reset_requests(self):
+        with self.lock:
+            self.requests = Counter()
+
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    def fail_next(self, status, count=1, headers=None):
+        """Answer the next `count` Synthetics requests with `status` and `headers`."""
+        with self.lock:
+            self._failures.extend([(status, headers or {}, b'')] * count)
+
+    def fail_monitor(self, monitor, status, method=None):
+        """Answer every request for `monitor`, or only those of `method`, with `status`."""
+        with self.lock:
+            self._broken_monitors[monitor] = (method, status)
+
+    def expire_sessions(self, after=0):
+        """Log everyone out after serving `after` more Synthetics requests."""
+        with self.lock:
+            self._expire_after = after
+
+    def _count_towards_expiry(self):
+        with self.lock:
+            if self._expire_after == 0:
+                self.session = uuid.uuid4().hex
+                self._expire_after = None
+            elif self._expire_after is not None:
+                self._expire_after -= 1
+
+    def _logged_in(self, handler):
+        cookies = SimpleCookie(handler.headers.get('Cookie', ''))
+        return 'session' in cookies and cookies['session'].value == self.session
+
+    def _count(self, method, endpoint):
+        with self.lock:
+            self.requests[(method, endpoint)] += 1
+
+    # Endpoints. Each returns (status, headers, body).
+
+    def handle(self, handler, method, endpoint, params, query, body):
+        if endpoint in ('LOGIN', 'IDLE'):
+            return getattr(self, '{}_{}'.format(method.lower(), endpoint.lower()))(handler, body)
+
+        self._count_towards_expiry()
+        if not self._logged_in(handler):
+            return 302, {'Location': self.login_url + '/login'}, b''
+
+        with self.lock:
+            failure = self._failures.pop(0) if self._failures else None
+            broken = self._broken_monitors.get(params.get('monitor'))
+        if failure:
+            return failure
+        if broken and broken[0] in (None, method):
+            return self._json({'error': 'Internal server error'}, broken[1])
+        if self.throttle_rate and self.random.random() < self.throttle_rate:
+            return 429, {'Retry-After': '0'}, b''
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 502, {}, b''
+
+        function = getattr(self, '{}_{}'.format(method.lower(), endpoint.lower()), None)
+        if function is None:
+            return 405, {}, b''
+        if self._modified_since(params, handler.headers.get('If-Unmodified-Since')):
+            return self._json({'error': 'Monitor was modified'}, 412)
+        status, headers, body = function(params, query, body)
+        if self.etags and method == 'GET' and status == 200:
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            if handler.headers.get('If-None-Match') == etag:
+                return 304, {'ETag': etag}, b''
+            headers = dict(headers, ETag=etag)
+        return status, headers, body
+
+    def _modified_since(self, params, unmodified_since):
+        monitor = self.monitors.get(params.get('monitor'))
+        if monitor is None or not unmodified_since:
+            return False
+        modified = datetime.strptime(monitor['modifiedAt'][:19], '%Y-%m-%dT%H:%M:%S')
+        return modified > parsedate_to_datetime(unmodified_since).replace(tzinfo=None)
+
+    def get_login(self, handler, body):
+        return 200, {}, b'<input name="authenticity_token" value="fake-token">'
+
+    def post_login(self, handler, body):
+        form = parse_qs(body.decode('utf-8'))
+        if not form.get('login[email]') or not form.get('login[password]'):
+            return 200, {}, b'<input id="login_email">'
+        headers = {'Set-Cookie': ['session={}; Path=/'.format(self.session),
+                                  'XSRF-TOKEN=fake-xsrf; Path=/']}
+        return 200, headers, b'Welcome'
+
+    def get_idle(self, handler, body):
+        if self._logged_in(handler):
+            return 200, {}, b'OK'
+        return 302, {'Location': self.login_url + '/login'}, b''
+
+    def get_synthetics(self, params, query, body):
+        return 200, {}, '<script>{{"accountId":{}}}</script>'.format(ACCOUNT).encode('utf-8')
+
+    def get_account_info(self, params, query, body):
+        return self._json({'accountList': [{'id': ACCOUNT, 'name': 'Fake account'}]})
+
+    def get_monitors_v2(self, params, query, body):
+        offset = int(query.get('offset', ['0'])[0])
+        limit = min(int(query.get('limit', ['15'])[0]), self.max_page_size)
+        with self.lock:
+            monitors = sorted(self.monitors.values(), key=lambda monitor: monitor['id'])
+        fields = ('id', 'name', 'type', 'status', 'frequency', 'uri', 'modifiedAt')
+        page = [dict((key, monitor[key]) for key in fields)
+                for monitor in monitors[offset:offset + limit]]
+        data = {'data': page}
+        if self.listing_total:
+            data['count'] = len(monitors)
+        return self._json(data)
+
+    def post_monitors(self, params, query, body):
+        monitor = json.loads(body.decode('utf-8'))
+        with self.lock:
+            monitor = dict(make_monitor(len(self.monitors)), **monitor)
+            monitor['id'] = str(uuid.uuid4())
+            self.monitors[monitor['id']] = monitor
+        return self._json(monitor)
+
+    def get_new_monitor(self, params, query, body):
+        return 200, {}, b'<html>New monitor</html>'
+
+    def get_monitor_json(self, params, query, body):
+        monitor = self.monitors.get(params['monitor'])
+        if monitor is None:
+            return self._json({'error': 'Not found'}, 404)
+        return self._json(monitor)
+
+    def put_monitor_json(self, params, query, body):
+        with self.lock:
+            if params['monitor'] not in self.monitors:
+                return self._json({'error': 'Not found'}, 404)
+            monitor = self.monitors[params['monitor']]
+            monitor.update(json.loads(body.decode('utf-8')))
+            modified = datetime.strptime(monitor['createdAt'][:19], '%Y-%m-%dT%H:%M:%S')
+            monitor['modifiedAt'] = _timestamp(
+                max(modified, datetime.utcnow().replace(microsecond=0)) + timedelta(seconds=1))
+        return self._json(monitor)
+
+    def delete_monitor_json(self, params, query, body):
+        with self.lock:
+            if self.monitors.pop(params['monitor'], None) is None:
+                return self._json({'error': 'Not found'}, 404)
+        return 204, {}, b''
+
+    def get_monitor_stoplight(self, params, query, body):
+        if params['monitor'] not in self.monitors:
+            return self._json({'error': 'Not found'}, 404)
+        number = int(uuid.UUID(params['monitor'])) % 7
+        return self._json({
+            'severity': [2, 2, 2, 1, 2, 0, 2][number],
+            'success_ratio': 1 - number / 100.0,
+            'avg_size': 1024 * (number + 1),
+            'load_time_50th_pr': 100.0 + number,
+            'load_time_95th_pr': 200.0 + number,
+        })
+
+    def get_monitor_locations(self, params, query, body):
+        return self._json(dict(
+            (name, {'name': name, 'label': name.title(), 'continent': 'Earth',
+                    'available': True, 'private': False})
+            for name in LOCATIONS))
+
+    @staticmethod
+    def _json(data, status=200):
+        return status, {'Content-Type': 'application/json'}, json.dumps(data).encode('utf-8')
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is only available from Python 3.7.
+    daemon_threads = True
+
+
+def _make_handler(server, routes):
+    routes = [(name, re.compile(pattern + '$')) for name, pattern in routes]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes, without this Nagle's
+        # algorithm and delayed ACKs add 40ms to requests on kept-alive
+        # connections.
+        disable_nagle_algorithm = True
+
+        def _handle(self, method):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+
+            for endpoint, pattern in routes:
+                match = pattern.match(url.path)
+                if match:
+                    break
+            else:
+                endpoint, match = None, None
+
+            server._count(method, endpoint)
+            if server.latency:
+                time.sleep(server.latency)
+
+            if endpoint is None:
+                status, headers, body = 404, {}, b''
+            else:
+                status, headers, body = server.handle(
+                    self, method, endpoint, match.groupdict(), parse_qs(url.query), body)
+
+            self.send_response(status)
+            for header, values in headers.items():
+                for value in values if isinstance(values, list) else [values]:
+                    self.send_header(header, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def do_PUT(self):
+            self._handle('PUT')
+
+        def do_DELETE(self):
+            self._handle('DELETE')
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
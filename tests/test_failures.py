@@ -0,0 +1,62 @@
+"""
+Commands acting on many monitors when some of them fail.
+"""
+import click
+import pytest
+
+
+@pytest.fixture
+def neres(neres):
+    def run(*args):
+        return neres('--no-cache', '--retries', '0', *args)
+    return run
+
+
+def test_update_from_statefile_partial_failure(server, neres, tmpdir):
+    statefile = tmpdir.join('state.yml')
+    statefile.write(neres('get-state').output)
+    statefile.write(statefile.read().replace('frequency: 5\n', 'frequency: 1440\n'))
+    changed = [monitor for monitor in server.monitors.values() if monitor['frequency'] == 5]
+    broken = changed[0]['id']
+    server.fail_monitor(broken, 500, method='PUT')
+
+    result = neres('update-from-statefile', '--apply', str(statefile))
+    assert result.exit_code == 1
+    assert 'Failed to update 1 monitors' in result.output
+    assert ' {}: '.format(broken) in result.output
+    for monitor in changed[1:]:
+        assert server.monitors[monitor['id']]['frequency'] == 1440
+    assert server.monitors[broken]['frequency'] == 5
+
+
+@pytest.mark.parametrize('command', [
+    ['list-monitors'],
+    ['list-monitors', '--raw'],
+    ['list-monitors', '--format', 'ndjson'],
+    ['get-state'],
+    ['get-state', '--format', 'json'],
+])
+def test_monitor_fetch_partial_failure(server, neres, command):
+    broken = sorted(server.monitors)[0]
+    server.fail_monitor(broken, 500, method='GET')
+
+    result = neres(*command)
+    assert result.exit_code == 1
+    assert 'Error fetching monitor {}'.format(broken) in result.stderr
+    for monitor in server.monitors.values():
+        if monitor['id'] != broken:
+            assert monitor['name'] in result.output
+
+
+def test_delete_monitors_partial_failure(server, neres):
+    monitors = sorted(server.monitors)[:3]
+    unknown = '00000000-0000-0000-0000-00000000dead'
+
+    result = neres('delete-monitors', '--confirm', '4', unknown, *monitors)
+    assert result.exit_code == 1
+    assert 'Failed to delete 1 of 4 monitors' in result.stderr
+    lines = dict(line.split(' ', 1) for line in click.unstyle(result.output).splitlines())
+    assert lines[unknown].startswith('Error 404')
+    for monitor in monitors:
+        assert lines[monitor] == 'OK'
+        assert monitor not in server.monitors
@@ -0,0 +1,103 @@
+"""
+Login session handling of the cli against the fake Synthetics server.
+"""
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from neres import cli
+from tests.fakeserver import ACCOUNT, EMAIL, PASSWORD
+
+
+@pytest.fixture
+def neres(neres):
+    def run(*args):
+        return neres('--no-cache', '--session-ttl', '300', *args)
+    return run
+
+
+def session_state(tmpdir):
+    return tmpdir.join('.config', 'neres', 'newrelic.session')
+
+
+def test_probe_skipped_within_ttl(server, neres):
+    assert neres('list-locations').exit_code == 0
+    assert server.requests[('GET', 'IDLE')] == 0
+
+    assert neres('--session-ttl', '0', 'list-locations').exit_code == 0
+    assert server.requests[('GET', 'IDLE')] == 1
+
+
+def test_reverify_after_login_redirect(server, neres):
+    # A single request bounces to the login page while the session is valid.
+    server.fail_next(302, headers={'Location': server.login_url + '/login'})
+    result = neres('list-locations')
+    assert result.exit_code == 0, result.stderr
+    assert server.requests[('GET', 'IDLE')] == 1
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 2
+    assert server.requests[('POST', 'LOGIN')] == 0
+
+
+def test_login_again_from_environment(server, neres, monkeypatch):
+    monkeypatch.setenv('NERES_EMAIL', EMAIL)
+    monkeypatch.setenv('NERES_PASSWORD', PASSWORD)
+    server.expire_sessions(after=1)
+    result = neres('list-monitors', '--ids-only')
+    assert result.exit_code == 0, result.stderr
+    assert server.requests[('POST', 'LOGIN')] == 1
+    assert sorted(result.output.split()) == sorted(server.monitors)
+
+
+def test_session_expired(server, neres, tmpdir):
+    assert session_state(tmpdir).check()
+    server.expire_sessions(after=1)
+    result = neres('list-monitors', '--ids-only')
+    assert result.exit_code == 1
+    assert 'Session expired, login again' in result.stderr
+    assert server.requests[('POST', 'LOGIN')] == 0
+    # The next command checks the session instead of trusting it.
+    assert not os.path.exists(str(session_state(tmpdir)))
+
+
+def test_accounts_kept_when_logging_in_again(server):
+    def list_locations(email):
+        command = ['--email', email, '--password', PASSWORD, '--no-cache', 'list-locations']
+        result = CliRunner(mix_stderr=False).invoke(cli.cli, command)
+        assert result.exit_code == 0, result.stderr
+
+    for _ in range(3):
+        list_locations(EMAIL)
+    assert server.requests[('GET', 'ACCOUNT_INFO')] == 1
+    # Someone else has accounts of their own.
+    list_locations('someone@example.com')
+    assert server.requests[('GET', 'ACCOUNT_INFO')] == 2
+
+
+def with_credentials(*args):
+    command = ['--email', EMAIL, '--password', PASSWORD, '--no-cache', '--account', str(ACCOUNT)]
+    return CliRunner(mix_stderr=False).invoke(cli.cli, command + list(args))
+
+
+def test_credentials_trust_verified_session(server):
+    assert with_credentials('--session-ttl', '300', 'list-locations').exit_code == 0
+    assert server.total_requests() == 1
+
+    assert with_credentials('--session-ttl', '0', 'list-locations').exit_code == 0
+    assert server.requests[('GET', 'IDLE')] == 1
+    assert server.requests[('POST', 'LOGIN')] == 0
+
+
+def test_credentials_login_when_session_is_invalid(server):
+    server.session = 'another-session'
+    result = with_credentials('--session-ttl', '0', 'list-locations')
+    assert result.exit_code == 0, result.stderr
+    assert server.requests[('POST', 'LOGIN')] == 1
+
+
+def test_login_again_with_credentials(server):
+    server.expire_sessions(after=1)
+    result = with_credentials('list-monitors', '--ids-only')
+    assert result.exit_code == 0, result.stderr
+    assert server.requests[('POST', 'LOGIN')] == 1
+    assert sorted(result.output.split()) == sorted(server.monitors)
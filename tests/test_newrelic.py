@@ -0,0 +1,106 @@
+"""
+The neres.newrelic API against the fake Synthetics server.
+"""
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from neres import newrelic
+from neres.asyncclient import AsyncClient
+from tests.fakeserver import ACCOUNT
+
+
+@pytest.fixture(autouse=True)
+def library_session(server):
+    # Use the session like library users do, without what the cli sets up.
+    newrelic.session.cache = None
+    newrelic.session.limiter = None
+    newrelic.session.observers = []
+
+
+@pytest.mark.parametrize('monitors', [0, 7, 21, 25])
+@pytest.mark.parametrize('max_page_size,listing_total', [(7, False), (7, True), (100, True)])
+def test_monitor_pages(server, monitors, max_page_size, listing_total):
+    for monitor in sorted(server.monitors)[monitors:]:
+        del server.monitors[monitor]
+    server.max_page_size = max_page_size
+    server.listing_total = listing_total
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        listed = [item['id'] for page in newrelic._iter_monitor_pages(ACCOUNT, executor, 10, 4)
+                  for item in page]
+    # Every monitor exactly once, no page overlaps another.
+    assert sorted(listed) == sorted(server.monitors)
+    if listing_total:
+        page_size = min(10, max_page_size)
+        assert server.requests[('GET', 'MONITORS_V2')] == max(1, math.ceil(monitors / page_size))
+
+
+def test_iter_monitors_stops_early(server):
+    server.latency = 0.05
+    monitors = newrelic.iter_monitors(ACCOUNT, concurrency=2, page_size=10)
+    next(monitors)
+    monitors.close()
+    # Details still pending when the consumer stopped were never requested.
+    assert server.requests[('GET', 'MONITOR_JSON')] < 10
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_async_client_matches_sync_api(server):
+    async def fetch():
+        async with AsyncClient(ACCOUNT, concurrency=4, page_size=10) as client:
+            return await client.get_state(), await client.get_monitors(raw=True)
+
+    async_state, async_monitors = run(fetch())
+    assert async_state == newrelic.get_state(ACCOUNT, concurrency=4, page_size=10)
+    monitors = newrelic.get_monitors(ACCOUNT, concurrency=4, page_size=10, raw=True)
+    assert [monitor.raw for monitor in async_monitors] == [monitor.raw for monitor in monitors]
+
+
+def test_async_client_fetches_fresh_state(server):
+    async def state():
+        async with AsyncClient(ACCOUNT) as client:
+            return await client.get_state()
+
+    monitor = sorted(server.monitors)[0]
+    before = [item for item in run(state()) if item['id'] == monitor]
+    server.monitors[monitor]['frequency'] = 1440
+    after = [item for item in run(state()) if item['id'] == monitor]
+    assert before[0]['frequency'] != 1440
+    assert after[0]['frequency'] == 1440
+
+
+def test_update_monitor_retries_on_conflict(server):
+    monitor = sorted(server.monitors)[0]
+    base = newrelic.get_monitor(ACCOUNT, monitor, stoplight=False)
+    # Someone else changes the monitor after we fetched it.
+    server.monitors[monitor].update(emails=['new@example.com'],
+                                    modifiedAt='2021-01-01T00:00:00.000+0000')
+
+    status, _, _ = newrelic.update_monitor(ACCOUNT, monitor, base=base, frequency=60)
+    assert status == 0
+    # The first PUT fails its precondition, the second works on a fresh document.
+    assert server.requests[('PUT', 'MONITOR_JSON')] == 2
+    assert server.monitors[monitor]['emails'] == ['new@example.com']
+    assert server.monitors[monitor]['frequency'] == 60
+
+
+def test_update_monitor_skips_cache(server, neres):
+    monitor = sorted(server.monitors)[0]
+    assert neres('get-monitor', monitor).exit_code == 0
+    # Changed without touching modifiedAt, so no precondition can catch it.
+    server.monitors[monitor]['emails'] = ['new@example.com']
+
+    result = neres('update-monitor', monitor, '--frequency', '60')
+    assert result.exit_code == 0, result.stderr
+    assert server.monitors[monitor]['emails'] == ['new@example.com']
+    assert str(server.monitors[monitor]['frequency']) == '60'
@@ -0,0 +1,56 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from neres.profiling import Profiler, _category
+
+
+def test_category():
+    assert _category(('~', 0, "<method 'recv_into' of '_socket.socket' objects>")) == 'network'
+    assert _category(('~', 0, "<method 'acquire' of '_thread.lock' objects>")) == 'waiting'
+    assert _category(('~', 0, '<built-in method time.sleep>')) == 'waiting'
+    assert _category(('neres/newrelic.py', 10, 'get_monitors')) == 'python'
+
+
+def _work():
+    time.sleep(0.01)
+
+
+def test_profiler_sees_threads(tmpdir):
+    profiler = Profiler('wall')
+    profiler.start()
+    thread = threading.Thread(target=_work)
+    thread.start()
+    thread.join()
+    profiler.stop()
+
+    functions = [name for _, _, name in profiler.stats().stats]
+    assert '_work' in functions
+
+    output = io.StringIO()
+    profiler.report(output)
+    assert 'Waiting on locks and sleeping' in output.getvalue()
+
+    profiler.dump(str(tmpdir.join('neres.pstats')))
+    assert tmpdir.join('neres.pstats').check()
+
+
+def test_profiler_cpu_clock():
+    profiler = Profiler('cpu')
+    profiler.start()
+    sum(range(10000))
+    profiler.stop()
+    assert profiler.stats().total_tt >= 0
+
+
+def test_profiler_thread_pool():
+    profiler = Profiler('wall')
+    profiler.start()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda number: _work() or number, range(8)))
+    profiler.stop()
+
+    assert results == list(range(8))
+    functions = [name for _, _, name in profiler.stats().stats]
+    assert '_work' in functions
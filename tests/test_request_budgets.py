@@ -0,0 +1,222 @@
+"""
+Request budgets of the cli commands.
+
+Every command runs against the fake Synthetics server and the number of
+requests it makes is checked against a budget that depends on the number of
+monitors N. A change that adds requests per monitor breaks these.
+"""
+import math
+
+import pytest
+from click.testing import CliRunner
+
+from neres import cli
+from tests.fakeserver import EMAIL, PASSWORD
+
+PAGE_SIZE = 10
+CONCURRENCY = 4
+# Checking the login session with the IDLE endpoint.
+AUTH = 1
+
+
+def pages(monitors):
+    # Pages with monitors, plus the page that ends the listing and the one
+    # telling a short first page from a server cap on the page size.
+    return math.ceil(monitors / PAGE_SIZE) + 2
+
+
+@pytest.fixture(params=[0, 1, 25])
+def server_options(request):
+    return {'monitors': request.param}
+
+
+@pytest.fixture
+def neres(neres):
+    def run(*args, exit_code=0, **kwargs):
+        result = neres('--no-cache', '--session-ttl', '0', '--concurrency', str(CONCURRENCY),
+                       '--page-size', str(PAGE_SIZE), *args, **kwargs)
+        assert result.exit_code == exit_code, result.stderr
+        return result
+    return run
+
+
+def monitor_ids(server):
+    return sorted(server.monitors)
+
+
+def requests(server, method, endpoint):
+    return server.requests[(method, endpoint)]
+
+
+def test_login(server):
+    CliRunner().invoke(cli.cli, ['--email', EMAIL, '--password', PASSWORD, 'login'])
+    assert server.total_requests() == 2
+
+
+@pytest.mark.parametrize('options', [[], ['--raw'], ['--format', 'ndjson']])
+def test_list_monitors(server, neres, options):
+    n = len(server.monitors)
+    neres('list-monitors', *options)
+    assert requests(server, 'GET', 'MONITOR_JSON') == n
+    assert requests(server, 'GET', 'MONITOR_STOPLIGHT') == n
+    assert server.total_requests() <= AUTH + pages(n) + 2 * n
+
+
+@pytest.mark.parametrize('options', [['--ids-only'], ['--ids-only', '--format', 'csv']])
+def test_list_monitor_ids(server, neres, options):
+    n = len(server.monitors)
+    result = neres('list-monitors', *options)
+    assert sorted(result.output.split()) == sorted(server.monitors)
+    assert server.total_requests() <= AUTH + pages(n)
+
+
+def test_get_state(server, neres):
+    n = len(server.monitors)
+    neres('get-state')
+    assert requests(server, 'GET', 'MONITOR_JSON') == n
+    assert requests(server, 'GET', 'MONITOR_STOPLIGHT') == 0
+    assert server.total_requests() <= AUTH + pages(n) + n
+
+
+def test_update_from_statefile(server, neres, tmpdir):
+    n = len(server.monitors)
+    statefile = tmpdir.join('state.yml')
+    statefile.write(neres('get-state').output)
+    changed = statefile.read().replace('frequency: 5\n', 'frequency: 1440\n')
+    statefile.write(changed)
+    modified = changed.count('frequency: 1440\n')
+
+    server.reset_requests()
+    neres('update-from-statefile', '--apply', str(statefile))
+    assert requests(server, 'PUT', 'MONITOR_JSON') == modified
+    assert server.total_requests() <= AUTH + pages(n) + n + modified
+
+
+def test_get_monitor(server, neres):
+    if not server.monitors:
+        pytest.skip('No monitors')
+    neres('get-monitor', monitor_ids(server)[0])
+    assert server.total_requests() <= AUTH + 2
+
+
+def test_update_monitor(server, neres):
+    if not server.monitors:
+        pytest.skip('No monitors')
+    neres('update-monitor', monitor_ids(server)[0], '--frequency', '60')
+    assert server.total_requests() <= AUTH + 2
+
+
+def test_delete_monitor(server, neres):
+    if not server.monitors:
+        pytest.skip('No monitors')
+    monitor = monitor_ids(server)[0]
+    neres('delete-monitor', monitor, '--confirm', monitor)
+    assert server.total_requests() <= AUTH + 1
+
+
+def test_delete_monitors(server, neres):
+    monitors = monitor_ids(server)[:3]
+    if not monitors:
+        pytest.skip('No monitors')
+    neres('delete-monitors', '-', '--confirm', str(len(monitors)),
+          input='\n'.join(monitors))
+    assert server.total_requests() <= AUTH + len(monitors)
+
+
+def test_delete_monitors_match(server, neres):
+    n = len(server.monitors)
+    if not n:
+        pytest.skip('No monitors')
+    neres('delete-monitors', '--match', '0$', '--confirm', str(math.ceil(n / 10)))
+    assert requests(server, 'GET', 'MONITOR_JSON') == 0
+    assert server.total_requests() <= AUTH + pages(n) + math.ceil(n / 10)
+
+
+def test_add_monitor(server, neres):
+    neres('add-monitor', 'example', 'https://example.com')
+    assert server.total_requests() <= AUTH + 2
+
+
+def test_add_monitors(server, neres, tmpdir):
+    specfile = tmpdir.join('monitors.csv')
+    specfile.write('name,uri\n' + ''.join('monitor-{0},https://example.com/{0}\n'.format(number)
+                                          for number in range(5)))
+    neres('add-monitors', str(specfile))
+    assert requests(server, 'POST', 'MONITORS') == 5
+    assert server.total_requests() <= AUTH + 1 + 5
+
+
+def test_add_monitors_from_state(server, neres, tmpdir):
+    n = len(server.monitors)
+    statefile = tmpdir.join('state.yml')
+    statefile.write(neres('get-state').output)
+
+    server.reset_requests()
+    neres('add-monitors', str(statefile))
+    assert requests(server, 'POST', 'MONITORS') == n
+    assert server.total_requests() <= AUTH + 1 + n
+
+
+def test_list_locations(server, neres):
+    neres('list-locations')
+    assert server.total_requests() <= AUTH + 1
+
+
+def test_list_accounts(server, neres):
+    neres('list-accounts', '--refresh')
+    assert server.total_requests() <= AUTH + 2
+    server.reset_requests()
+    neres('list-accounts')
+    assert server.total_requests() <= AUTH
+
+
+def test_open(server, neres, monkeypatch):
+    monkeypatch.setattr('subprocess.Popen', lambda *args, **kwargs: None)
+    monkeypatch.setattr('os.startfile', lambda *args: None, raising=False)
+    neres('open', 'some-monitor')
+    assert server.total_requests() == 0
+
+
+def test_get_state_incremental(server, neres):
+    n = len(server.monitors)
+    full = neres('get-state').output.split('\n', 1)[1]
+
+    server.reset_requests()
+    first = neres('get-state', '--incremental').output.split('\n', 1)[1]
+    assert first == full
+    assert requests(server, 'GET', 'MONITOR_JSON') == n
+
+    server.reset_requests()
+    second = neres('get-state', '--incremental').output.split('\n', 1)[1]
+    assert second == full
+    assert requests(server, 'GET', 'MONITOR_JSON') == 0
+    assert server.total_requests() <= AUTH + pages(n)
+
+    # Modify, remove and add monitors behind neres' back.
+    monitors = monitor_ids(server)
+    for monitor in monitors[:2]:
+        server.monitors[monitor].update(frequency=1440, modifiedAt='2021-01-01T00:00:00.000+0000')
+    for monitor in monitors[2:3]:
+        del server.monitors[monitor]
+    neres('add-monitor', 'new-monitor', 'https://example.com/new')
+
+    server.reset_requests()
+    result = neres('get-state', '--incremental', '--verify')
+    assert 'Incremental state is identical to a full fetch' in result.stderr
+    assert result.output.split('\n', 1)[1] == neres('get-state').output.split('\n', 1)[1]
+
+
+def test_get_state_incremental_verify_fails(server, neres):
+    if not server.monitors:
+        pytest.skip('No monitors')
+    neres('get-state', '--incremental')
+    # Change a monitor without changing its modifiedAt, which neres can't notice.
+    monitor = monitor_ids(server)[0]
+    server.monitors[monitor]['frequency'] = 1440
+
+    result = neres('get-state', '--incremental', '--verify', exit_code=1)
+    assert 'Monitor {} differs from a full fetch'.format(monitor) in result.stderr
+    # The next incremental run fetches everything again.
+    server.reset_requests()
+    neres('get-state', '--incremental')
+    assert requests(server, 'GET', 'MONITOR_JSON') == len(server.monitors)
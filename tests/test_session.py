@@ -0,0 +1,311 @@
+"""
+neres.session.Session against the fake Synthetics server.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from neres import newrelic, urls
+from neres.cache import Cache
+from neres.session import AdaptiveLimiter, Session
+from tests.fakeserver import ACCOUNT
+
+
+@pytest.fixture
+def server_options():
+    return {'monitors': 3}
+
+
+@pytest.fixture
+def session(server):
+    session = Session()
+    session.cookies.set('session', 'valid')
+    session.retry_policy.backoff = 0
+    return session
+
+
+def locations_url():
+    return urls.MONITOR_LOCATIONS.format(account=ACCOUNT)
+
+
+def create_monitor(session):
+    return session.post(urls.MONITORS.format(account=ACCOUNT),
+                        data=json.dumps({'name': 'example', 'uri': 'https://example.com'}))
+
+
+def test_memo_is_off_outside_commands(server, session):
+    session.get(locations_url())
+    session.get(locations_url())
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 2
+    assert session.requests_saved == 0
+
+
+def test_memo_collapses_requests_in_flight(server, session):
+    server.latency = 0.2
+    session.start_command()
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(session.get(locations_url())))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 1
+    assert session.requests_saved == 4
+    assert len(set(id(response) for response in responses)) == 1
+
+    # Responses aren't kept once the request is over.
+    session.get(locations_url())
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 2
+    assert session.requests_saved == 4
+
+
+def test_memo_ends_with_command(server, session):
+    session.start_command()
+    session.get(locations_url())
+    session.end_command()
+    assert session.stats()['requests_saved'] == 0
+
+    session.get(locations_url())
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 2
+
+
+def test_observed_latency_excludes_queueing(server, session):
+    server.latency = 0.2
+    session.limiter = AdaptiveLimiter(floor=1, ceiling=1)
+    records = []
+    session.observers.append(records.append)
+    threads = [threading.Thread(target=session.get, args=(locations_url(),)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(records) == 3
+    assert max(record['latency'] for record in records) < 0.35
+    # Requests took turns behind the limiter.
+    assert max(record['queued'] for record in records) >= 0.35
+
+
+def test_pool_reuses_connections(server, session):
+    server.latency = 0.02
+    session.configure_pool(3)
+    # More threads than connections, the rest wait for a free one.
+    threads = [threading.Thread(target=lambda: [session.get(locations_url()) for _ in range(3)])
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = session.stats()
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 24
+    assert stats['connections_new'] <= 3
+    assert stats['connections_new'] + stats['connections_reused'] == 24
+
+
+def test_pool_sized_to_concurrency(server, neres):
+    assert neres('--no-cache', '--concurrency', '5', 'list-locations').exit_code == 0
+    for adapter in newrelic.session.pool_adapters:
+        assert adapter.poolmanager.connection_pool_kw['maxsize'] == 5
+        assert adapter.poolmanager.connection_pool_kw['block'] is True
+
+
+def respond(limiter, latency=0.1, status=200):
+    limiter.acquire()
+    limiter.release(time.time() - latency, 'MONITOR_JSON', status)
+
+
+def throttle(limiter, status=429):
+    # Requests started after the last decrease count as a new congestion event.
+    time.sleep(0.001)
+    limiter.release(limiter.acquire(), 'MONITOR_JSON', status)
+
+
+def test_limiter_halves_once_per_congestion_event():
+    limiter = AdaptiveLimiter(floor=1, ceiling=16)
+    assert limiter.limit == 8
+    in_flight = [limiter.acquire() for _ in range(4)]
+    for started in in_flight:
+        limiter.release(started, 'MONITOR_JSON', 429)
+    assert limiter.limit == 4
+
+    throttle(limiter, 503)
+    assert limiter.limit == 2
+    assert limiter.lowest == 2
+
+
+def test_limiter_stays_within_floor_and_ceiling():
+    limiter = AdaptiveLimiter(floor=2, ceiling=6)
+    for _ in range(5):
+        throttle(limiter)
+    assert limiter.limit == 2
+
+    for _ in range(100):
+        respond(limiter)
+    assert limiter.limit == limiter.highest == 6
+
+
+def test_limiter_grows_after_limit_healthy_responses():
+    limiter = AdaptiveLimiter(floor=1, ceiling=8)
+    assert limiter.limit == 4
+    for _ in range(3):
+        respond(limiter)
+    assert limiter.limit == 4
+    respond(limiter)
+    assert limiter.limit == 5
+    for _ in range(5):
+        respond(limiter)
+    assert limiter.limit == 6
+
+
+def test_limiter_latency_spike_is_congestion():
+    limiter = AdaptiveLimiter(floor=1, ceiling=8)
+    for _ in range(10):
+        respond(limiter, latency=0.1)
+    limit = limiter.limit
+    # A single slow response isn't a spike, a run of them is.
+    respond(limiter, latency=0.15)
+    assert limiter.limit == limit
+    respond(limiter, latency=1.0)
+    assert limiter.limit == limit // 2
+
+
+def test_get_retried_on_server_error(server, session):
+    server.fail_next(502, count=2)
+    assert session.get(locations_url()).status_code == 200
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 3
+    assert session.retries == 2
+
+
+def test_post_not_retried_on_server_error(server, session):
+    server.fail_next(502)
+    assert create_monitor(session).status_code == 502
+    assert server.requests[('POST', 'MONITORS')] == 1
+    assert session.retries == 0
+
+
+def test_post_retried_when_throttled(server, session):
+    server.fail_next(429)
+    assert create_monitor(session).status_code == 200
+    assert server.requests[('POST', 'MONITORS')] == 2
+    assert session.retries == 1
+
+
+def test_retry_after(server, session):
+    server.fail_next(429, headers={'Retry-After': '0.3'})
+    started = time.time()
+    assert session.get(locations_url()).status_code == 200
+    assert time.time() - started >= 0.3
+
+
+def test_retry_budget(server, session):
+    session.retry_policy.budget = 2
+    server.fail_next(502, count=10)
+    # Three attempts, after which the budget is spent.
+    assert session.get(locations_url()).status_code == 502
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 3
+    assert session.get(locations_url()).status_code == 502
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 4
+    assert session.retries == 2
+
+
+def monitor_url(server):
+    return urls.MONITOR_JSON.format(account=ACCOUNT, monitor=sorted(server.monitors)[0])
+
+
+def test_cache_fresh(server, session, tmpdir):
+    session.cache = Cache(str(tmpdir.join('cache')))
+    first = session.get(locations_url())
+    second = session.get(locations_url())
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 1
+    assert session.cache_hits == 1
+    assert second.json() == first.json()
+
+
+def test_cache_stale_without_validators(server, session, tmpdir):
+    session.cache = Cache(str(tmpdir.join('cache')), ttls={'MONITOR_LOCATIONS': 0})
+    session.get(locations_url())
+    session.get(locations_url())
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 2
+    assert session.cache_hits == 0
+
+
+def test_cache_revalidates_stale_entries(server, session, tmpdir):
+    server.etags = True
+    session.cache = Cache(str(tmpdir.join('cache')), ttls={'MONITOR_LOCATIONS': 0})
+    first = session.get(locations_url())
+    assert first.headers['ETag']
+
+    second = session.get(locations_url())
+    assert server.requests[('GET', 'MONITOR_LOCATIONS')] == 2
+    assert session.cache_hits == 1
+    assert second.status_code == 200
+    assert second.json() == first.json()
+
+
+@pytest.mark.parametrize('method', ['put', 'delete'])
+def test_cache_invalidated_by_changes(server, session, tmpdir, method):
+    session.cache = Cache(str(tmpdir.join('cache')))
+    url = monitor_url(server)
+    session.get(url)
+    if method == 'put':
+        session.put(url, data=json.dumps({'frequency': 60}))
+    else:
+        session.delete(url)
+
+    response = session.get(url)
+    assert server.requests[('GET', 'MONITOR_JSON')] == 2
+    assert session.cache_hits == 0
+    assert response.status_code == (200 if method == 'put' else 404)
+
+
+def test_cache_prune(server, session, tmpdir):
+    cache = session.cache = Cache(str(tmpdir.join('cache')))
+    monitors = [urls.MONITOR_JSON.format(account=ACCOUNT, monitor=monitor)
+                for monitor in sorted(server.monitors)]
+    for age, url in zip((30, 20, 10), monitors):
+        session.get(url)
+        os.utime(cache._path(url), (time.time() - age, time.time() - age))
+    # A hit makes the oldest entry the most recently used.
+    session.get(monitors[0])
+
+    size = os.path.getsize(cache._path(monitors[0]))
+    cache.max_size = 2 * size + size // 2
+    cache.prune()
+    assert [os.path.exists(cache._path(url)) for url in monitors] == [True, False, True]
+
+
+def test_cache_concurrent_writes(server, session, tmpdir):
+    cache = session.cache = Cache(str(tmpdir.join('cache')))
+    response = session.get(locations_url())
+    errors = []
+
+    def put():
+        try:
+            for _ in range(20):
+                cache.put(locations_url(), response)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=put) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert cache.get(locations_url())['body'] == response.text
+    assert os.listdir(cache.directory) == [os.path.basename(cache._path(locations_url()))]
+
+
+def test_cache_write_failure(server, session, tmpdir):
+    cache = session.cache = Cache(str(tmpdir.join('cache')))
+    shutil.rmtree(cache.directory)
+    assert session.get(locations_url()).status_code == 200
+    assert cache.get(locations_url()) is None
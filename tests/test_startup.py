@@ -0,0 +1,48 @@
+"""
+Guard the startup time of the `neres` command.
+
+Every run of neres starts by importing neres.cli, so heavy dependencies must
+only be imported by the commands that use them.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Cumulative import time of neres.cli, in microseconds. It's about 40ms on a
+# laptop, importing requests, yaml and humanize up front takes it over 300ms.
+STARTUP_BUDGET = 150000
+
+# -X importtime is only available from Python 3.7.
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason='Needs -X importtime')
+
+HEAVY_MODULES = ['requests', 'urllib3', 'yaml', 'humanize',
+                 'terminaltables', 'subprocess', 'platform']
+
+
+def _import_times():
+    """Return the cumulative import time of each module imported by neres.cli."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import neres.cli'],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                             universal_newlines=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_no_heavy_imports():
+    imported = _import_times()
+    assert [module for module in HEAVY_MODULES if module in imported] == []
+
+
+def test_startup_budget():
+    # Take the best of a few runs to keep noise out.
+    best = min(_import_times()['neres.cli'] for _ in range(3))
+    assert best < STARTUP_BUDGET
@@ -0,0 +1,162 @@
+import io
+import json
+from collections import OrderedDict
+
+from neres import newrelic, state
+from neres.monitor import Monitor
+
+
+def _monitor(**kwargs):
+    monitor = {
+        'id': 'abc',
+        'name': 'Example',
+        'status': 'ENABLED',
+        'uri': 'https://example.com',
+        'slaThreshold': 7,
+        'emails': ['a@example.com', 'b@example.com'],
+        'locations': ['AWS_US_WEST_1'],
+        'frequency': 10,
+        'metadata': {},
+    }
+    monitor.update(kwargs)
+    return Monitor(monitor)
+
+
+def _state(**kwargs):
+    data = OrderedDict([
+        ('id', 'abc'),
+        ('name', 'Example'),
+        ('status', 'ENABLED'),
+        ('uri', 'https://example.com'),
+        ('slaThreshold', 7),
+        ('emails', ['b@example.com', 'a@example.com']),
+        ('locations', ['AWS_US_WEST_1']),
+        ('frequency', 10),
+        ('verify_ssl', False),
+        ('validation_string', False),
+        ('bypass_head_request', False),
+        ('redirect_is_failure', False),
+    ])
+    data.update(kwargs)
+    return data
+
+
+def test_reconcile_unchanged_ignores_order():
+    changes, missing = state.reconcile([_state()], [_monitor()])
+    assert changes == []
+    assert missing == []
+
+
+def test_reconcile_reports_missing():
+    changes, missing = state.reconcile([_state(id='xyz')], [_monitor()])
+    assert changes == []
+    assert missing == ['xyz']
+
+
+def test_reconcile_field_changes():
+    monitor = _monitor()
+    here = _state(frequency=720, emails=['a@example.com', 'c@example.com'], verify_ssl=True)
+    changes, missing = state.reconcile([here], [monitor])
+
+    assert len(changes) == 1
+    there, monitor_changes = changes[0]
+    assert there is monitor
+    assert list(monitor_changes) == ['emails', 'frequency', 'verify_ssl']
+
+    kwargs = state.update_arguments(monitor_changes)
+    assert kwargs == {
+        'add_emails': ['c@example.com'],
+        'remove_emails': ['b@example.com'],
+        'frequency': 720,
+        'verify_ssl': True,
+    }
+    assert state.format_changes(monitor_changes) == [
+        'emails: +c@example.com, -b@example.com',
+        'frequency: 10 -> 720',
+        'verify_ssl: False -> True',
+    ]
+
+
+def test_validate_spec_defaults():
+    kwargs = state.validate_spec({'name': 'Example', 'uri': 'https://example.com',
+                                  'validation_string': 'Welcome'})
+    assert kwargs['frequency'] == 10
+    assert kwargs['locations'] == ['AWS_US_WEST_1']
+    assert kwargs['status'] == 'ENABLED'
+    assert kwargs['bypass_head_request'] is True
+
+
+def test_validate_spec_csv_values():
+    kwargs = state.validate_spec({'name': 'Example', 'uri': 'https://example.com',
+                                  'emails': 'a@example.com; b@example.com',
+                                  'frequency': '60', 'verify_ssl': 'true'})
+    assert kwargs['emails'] == ['a@example.com', 'b@example.com']
+    assert kwargs['frequency'] == 60
+    assert kwargs['verify_ssl'] is True
+
+
+def test_validate_spec_ignores_id():
+    kwargs = state.validate_spec(_state())
+    assert 'id' not in kwargs
+    assert kwargs['name'] == 'Example'
+
+
+def test_validate_spec_errors():
+    try:
+        state.validate_spec({'color': 'red', 'uri': 'example.com', 'frequency': 7})
+    except ValueError as error:
+        message = str(error)
+    else:
+        assert False, 'ValueError not raised'
+    assert 'unknown fields color' in message
+    assert 'name is required' in message
+    assert 'uri must be' in message
+    assert 'frequency must be' in message
+
+
+def test_monitor_state():
+    monitor = _monitor(metadata={
+        'nr.synthetics.metadata.job.options.simple.bypass.head': 'true',
+        'nr.synthetics.metadata.job.options.response-validation': 'Welcome',
+        'nr.synthetics.monitor.tls-validation': True,
+    }, emails=[])
+    assert monitor.raw is None
+    assert newrelic._monitor_state(monitor) == _state(
+        emails='', verify_ssl=True, validation_string='Welcome', bypass_head_request=True)
+
+
+def _states():
+    return [_state(id='b', name='Beta', emails=''), _state(id='a', name='Alpha'),
+            _state(id='c', name='Café', validation_string='Welcome')]
+
+
+def test_state_writer_yaml():
+    writer = state.StateWriter()
+    for monitor_state in _states():
+        writer.add(monitor_state)
+    output = io.StringIO()
+    writer.write(output)
+
+    expected = sorted(_states(), key=lambda monitor_state: monitor_state['name'])
+    assert output.getvalue() == state.dump_yaml(expected)
+    assert state.load_state(io.BytesIO(output.getvalue().encode('utf-8'))) == expected
+    assert output.getvalue().startswith('- id: a\n  name: Alpha\n  status: ENABLED\n')
+
+
+def test_state_writer_json():
+    writer = state.StateWriter('json')
+    for monitor_state in _states():
+        writer.add(monitor_state)
+    output = io.StringIO()
+    writer.write(output)
+
+    expected = sorted(_states(), key=lambda monitor_state: monitor_state['name'])
+    assert output.getvalue() == json.dumps(expected, indent=2) + '\n'
+    assert state.load_state(io.BytesIO(output.getvalue().encode('utf-8'))) == expected
+
+
+def test_state_writer_empty():
+    for output_format in ('yaml', 'json'):
+        output = io.StringIO()
+        state.StateWriter(output_format).write(output)
+        assert state.load_state(io.StringIO(output.getvalue())) == []
@@ -0,0 +1,40 @@
+import io
+import json
+
+from neres.stats import RequestStats, Tracer, percentile
+
+
+def _record(endpoint, latency, status=200, retries=0):
+    return {'time': 0, 'method': 'GET', 'url': 'http://example.com', 'endpoint': endpoint,
+            'status': status, 'latency': latency, 'bytes': 10, 'retries': retries,
+            'error': None}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile([3], 0.95) == 3
+    assert percentile([], 0.5) == 0
+
+
+def test_request_stats():
+    request_stats = RequestStats()
+    for latency in (0.3, 0.1, 0.2):
+        request_stats(_record('MONITOR_JSON', latency))
+    request_stats(_record('IDLE', 0.5, status=502, retries=3))
+
+    assert request_stats.summary() == [
+        ('MONITOR_JSON', 3, 0.2, 0.3, 0.3, 30, 0, 0),
+        ('IDLE', 1, 0.5, 0.5, 0.5, 10, 3, 1),
+    ]
+
+
+def test_tracer():
+    output = io.StringIO()
+    tracer = Tracer(output)
+    tracer(_record('IDLE', 0.5))
+    tracer(_record('MONITOR_JSON', 0.1))
+
+    lines = output.getvalue().splitlines()
+    assert [json.loads(line)['endpoint'] for line in lines] == ['IDLE', 'MONITOR_JSON']